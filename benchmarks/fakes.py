@@ -0,0 +1,233 @@
+"""
+Local stand-ins for the external services used by the appraisal pipeline.
+
+Each fake sleeps for a configurable latency and fails with a configurable probability, so
+the pipeline can be measured offline and reproducibly.
+"""
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import numpy as np
+import requests
+
+class ServiceProfile:
+    """Latency (seconds, with +/-20% jitter) and failure rate for one fake service."""
+
+    def __init__(self, name, latency, failure_rate, rng):
+        self.name = name
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._rng = rng
+        self._lock = threading.Lock()
+
+    def call(self, exception=RuntimeError):
+        with self._lock:
+            delay = self.latency * self._rng.uniform(0.8, 1.2)
+            failed = self._rng.random() < self.failure_rate
+        time.sleep(delay)
+        if failed:
+            raise exception(f"Injected {self.name} failure")
+
+class FakeRedis:
+    """
+    In-memory subset of the redis-py client: strings (get, set with ex, getset, delete), the
+    set calls the image hash index uses and the sorted-set calls the caches use.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires_at = self._data.get(key, (None, None))
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        with self._lock:
+            self._data[key] = (value, time.time() + ex if ex else None)
+        return True
+
+    def getset(self, key, value):
+        previous = self.get(key)
+        self.set(key, value)
+        return previous
+
+    def delete(self, *keys):
+        with self._lock:
+            keys = [key.decode('utf-8') if isinstance(key, bytes) else key for key in keys]
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def _set(self, key):
+        return self._data.setdefault(key, (set(), None))[0]
+
+    def sadd(self, key, *members):
+        with self._lock:
+            self._set(key).update(member.encode('utf-8') if isinstance(member, str) else member for member in members)
+
+    def srem(self, key, *members):
+        with self._lock:
+            self._set(key).difference_update(member.encode('utf-8') if isinstance(member, str) else member for member in members)
+
+    def sunion(self, keys):
+        with self._lock:
+            return set().union(*(self._data[key][0] for key in keys if key in self._data))
+
+    def _zset(self, key):
+        return self._data.setdefault(key, ({}, None))[0]
+
+    def zadd(self, key, mapping):
+        with self._lock:
+            self._zset(key).update(mapping)
+
+    def zremrangebyscore(self, key, minimum, maximum):
+        with self._lock:
+            members = self._zset(key)
+            for member in [m for m, score in members.items() if minimum <= score <= maximum]:
+                del members[member]
+
+    def zcard(self, key):
+        with self._lock:
+            return len(self._zset(key))
+
+    def zpopmin(self, key, count=1):
+        with self._lock:
+            members = self._zset(key)
+            popped = sorted(members.items(), key=lambda item: item[1])[:count]
+            for member, _ in popped:
+                del members[member]
+            return [(member.encode('utf-8'), score) for member, score in popped]
+
+class FakeModel:
+    """Deterministic hashed bag-of-words encoder with the SentenceTransformer encode signature."""
+
+    def __init__(self, profile, dimension=384):
+        self.profile = profile
+        self.dimension = dimension
+
+    def _encode_one(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in text.lower().split():
+            digest = hashlib.md5(token.encode('utf-8')).digest()
+            vector[int.from_bytes(digest[:4], 'little') % self.dimension] += 1.0
+        return vector
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        if isinstance(sentences, str):
+            self.profile.call()
+            return self._encode_one(sentences)
+        self.profile.call()
+        return np.stack([self._encode_one(sentence) for sentence in sentences])
+
+class FakeVisionClient:
+    def __init__(self, profile, corpus):
+        self.profile = profile
+        self.corpus = corpus
+
+    def text_detection(self, image):
+        self.profile.call()
+        entry = self.corpus.entry_for_bytes(image.content)
+        text = f"{entry['series'].upper()}\n#{entry['issue_number']}\n{entry['year']}"
+        return SimpleNamespace(text_annotations=[SimpleNamespace(description=text)])
+
+class _FakeMessages:
+    def __init__(self, recognition_profile, report_profile, corpus):
+        self.recognition_profile = recognition_profile
+        self.report_profile = report_profile
+        self.corpus = corpus
+
+    def create(self, model, max_tokens, messages):
+        content = messages[0]['content']
+        if isinstance(content, list):
+            self.recognition_profile.call()
+            image_data = next(block for block in content if block['type'] == 'image')['source']['data']
+            entry = self.corpus.entry_for_bytes(base64.b64decode(image_data))
+            text = (f"Title: {entry['series'].title()}\nIssue Number: {entry['issue_number']}\n"
+                    f"Volume: {entry['volume']}\nYear: {entry['year']}")
+        else:
+            self.report_profile.call()
+            text = "Benchmark report. " * 150
+        return SimpleNamespace(content=[SimpleNamespace(type='text', text=text)])
+
+    @contextmanager
+    def stream(self, model, max_tokens, messages):
+        self.report_profile.call()
+        yield SimpleNamespace(text_stream=iter(["Benchmark report. "] * 150))
+
+class FakeAnthropicClient:
+    def __init__(self, recognition_profile, report_profile, corpus):
+        self.messages = _FakeMessages(recognition_profile, report_profile, corpus)
+
+class FakeHTTP:
+    """Replacement for utils.http_client.request serving eBay, OAuth and exchange-rate calls."""
+
+    def __init__(self, profiles, corpus, rng):
+        self.profiles = profiles
+        self.corpus = corpus
+        self._rng = rng
+        self._lock = threading.Lock()
+
+    def _response(self, payload):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(payload).encode('utf-8')
+        return response
+
+    def request(self, method, url, **kwargs):
+        if 'oauth2/token' in url:
+            self.profiles['ebay_token'].call(requests.exceptions.ConnectionError)
+            return self._response({'access_token': 'benchmark-token'})
+        if 'exchangerate-api' in url:
+            self.profiles['fx'].call(requests.exceptions.ConnectionError)
+            return self._response({'rates': {'GBP': 1.0, 'USD': 1.27, 'EUR': 1.17}})
+        if 'item_summary/search' in url:
+            self.profiles['ebay'].call(requests.exceptions.ConnectionError)
+            return self._response(self._search_results(kwargs.get('params', {}).get('q', '')))
+        raise requests.exceptions.ConnectionError(f"No fake configured for {url}")
+
+    def _search_results(self, query):
+        base_price = self.corpus.price_for_query(query)
+        now = datetime(2024, 6, 1)
+        items = []
+        with self._lock:
+            for _ in range(50):
+                currency = self._rng.choice(['GBP', 'GBP', 'USD', 'EUR'])
+                items.append({
+                    'price': {'value': f"{max(10.0, base_price * self._rng.uniform(0.6, 1.4)):.2f}", 'currency': currency},
+                    'itemEndDate': (now - timedelta(days=self._rng.randint(0, 120))).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                })
+        return {'itemSummaries': items}
+
+class Corpus:
+    """Fixture images and parsed catalogue entries, with a stable image -> entry mapping."""
+
+    def __init__(self, images, entries):
+        self.images = images
+        self.entries = entries
+
+    def entry_for_bytes(self, data):
+        digest = hashlib.md5(data).digest()
+        return self.entries[int.from_bytes(digest[:4], 'little') % len(self.entries)]
+
+    def price_for_query(self, query):
+        digest = hashlib.md5(query.encode('utf-8')).digest()
+        entry = self.entries[int.from_bytes(digest[:4], 'little') % len(self.entries)]
+        return entry['price'] or 25.0
+
+def make_profiles(latencies, failure_rates, scale, seed):
+    rng = random.Random(seed)
+    return {
+        name: ServiceProfile(name, latency * scale, failure_rates.get(name, 0.0), rng)
+        for name, latency in latencies.items()
+    }
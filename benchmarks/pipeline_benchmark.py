@@ -0,0 +1,240 @@
+"""
+Offline benchmark for the recognition -> lookup -> report pipeline.
+
+Run from the repository root, for example:
+
+    python -m benchmarks.pipeline_benchmark --requests 40 --concurrency 4 --output bench.json
+    python -m benchmarks.pipeline_benchmark --latency-scale 0.1 --compare bench.json
+
+Google Vision, Anthropic, the embedding model, the vector index, Redis, eBay and the
+exchange-rate API are replaced by the stand-ins in benchmarks/fakes.py. The fixture corpus
+is the images in uploads/ and the catalogue entries in databases/*.json, from which the
+vector index and the catalogue store are built in a temporary directory, so no local index
+or store affects the results. Results are written as JSON tagged with the current commit
+so runs can be compared.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Seconds per call before --latency-scale is applied
+DEFAULT_LATENCIES = {
+    'vision': 0.3,
+    'claude_vision': 1.5,
+    'claude_report': 4.0,
+    'embedding': 0.015,
+    'ebay_token': 0.2,
+    'ebay': 0.4,
+    'fx': 0.15,
+}
+
+def parse_overrides(value):
+    """Parse 'name=value,name=value' into a dict of floats."""
+    overrides = {}
+    for pair in filter(None, (value or '').split(',')):
+        name, number = pair.split('=')
+        overrides[name.strip()] = float(number)
+    return overrides
+
+def configure_environment(workdir, args):
+    # config.py reads these at import, so they must be set before any utils module is loaded
+    os.environ.update({
+        'ANTHROPIC_API_KEY': 'benchmark',
+        'VECTOR_INDEX_BACKEND': 'local',
+        'LOCAL_INDEX_PATH': os.path.join(workdir, 'vector_index'),
+        'CATALOGUE_STORE_PATH': os.path.join(workdir, 'catalogue_store'),
+        'DATABASE_EXACT_MATCH': 'true' if args.exact_match else 'false',
+        'IMAGE_HASH_THRESHOLD': os.environ.get('IMAGE_HASH_THRESHOLD', '6') if args.dedupe else '-1',
+        'EMBEDDING_CACHE_PATH': '',
+        'RECOGNITION_STRATEGY': args.strategy,
+    })
+
+def load_corpus(max_images):
+    from benchmarks.fakes import Corpus
+    from upload_vectors import parse_comic_entry
+
+    upload_dir = os.path.join(REPO_ROOT, 'uploads')
+    images = sorted(
+        os.path.join(upload_dir, name) for name in os.listdir(upload_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )[:max_images]
+
+    entries = []
+    database_dir = os.path.join(REPO_ROOT, 'databases')
+    for name in sorted(os.listdir(database_dir)):
+        if name.endswith('.json'):
+            with open(os.path.join(database_dir, name), 'r', encoding='utf-8') as f:
+                entries.extend(filter(None, (parse_comic_entry(entry) for entry in json.load(f))))
+    return Corpus(images, entries)
+
+def install_fakes(corpus, profiles, args):
+    from benchmarks import fakes
+    from upload_vectors import make_comic_id, entry_source
+    from utils import http_client, resources
+    from utils.catalogue_store import CatalogueStoreWriter
+    from utils.vector_index import LocalIndex
+
+    model = fakes.FakeModel(profiles['embedding'])
+    index = LocalIndex()
+    index.upsert([
+        {'id': make_comic_id(entry), 'values': model._encode_one(entry['full_title']), 'metadata': entry}
+        for entry in corpus.entries
+    ])
+    index.save()
+
+    store = CatalogueStoreWriter(os.environ['CATALOGUE_STORE_PATH'])
+    for entry in corpus.entries:
+        store.add(make_comic_id(entry), entry, entry_source(entry))
+    store.save()
+
+    redis_client = fakes.FakeRedis()
+    if not args.cache:
+        redis_client.set = lambda key, value, ex=None: True
+        redis_client.zadd = lambda key, mapping: None
+
+    client = fakes.FakeAnthropicClient(profiles['claude_vision'], profiles['claude_report'], corpus)
+    resources._resources.update({
+        'model': model,
+        'vector_index': index,
+        'vision_client': fakes.FakeVisionClient(profiles['vision'], corpus),
+        'anthropic_client': client,
+        'redis': redis_client,
+    })
+    http_client.request = fakes.FakeHTTP(profiles, corpus, random.Random(args.seed)).request
+    return client
+
+def percentiles(values):
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'count': len(values), 'p50': round(float(p50), 1), 'p95': round(float(p95), 1), 'p99': round(float(p99), 1)}
+
+def run_benchmark(corpus, client, args):
+    from utils.pipeline import appraise_comic
+
+    def run_one(image_path):
+        start = time.perf_counter()
+        try:
+            body, status = appraise_comic(image_path, client)
+        except Exception as e:
+            body, status = {'error': str(e)}, 'exception'
+        return status, body.get('timings', {}), (time.perf_counter() - start) * 1000
+
+    rng = random.Random(args.seed)
+    workload = [rng.choice(corpus.images) for _ in range(args.requests)]
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            outcomes = list(pool.map(run_one, workload))
+    wall = time.perf_counter() - start
+
+    stage_timings = {}
+    statuses = {}
+    for status, timings, total in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        stage_timings.setdefault('total', []).append(total)
+        for stage, elapsed in timings.items():
+            stage_timings.setdefault(stage, []).append(elapsed)
+
+    return {
+        'stages_ms': {stage: percentiles(values) for stage, values in stage_timings.items()},
+        'statuses': statuses,
+        'wall_seconds': round(wall, 2),
+        'throughput_rps': round(len(outcomes) / wall, 3) if wall else 0.0,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def collect_cache_stats():
+    from utils.database import get_embedding_cache_stats, get_exact_match_stats
+    from utils.ebay import get_cache_stats
+    from utils.image_processing import get_recognition_stats
+    return {
+        'ebay': get_cache_stats(),
+        'embedding': get_embedding_cache_stats(),
+        'exact_match': get_exact_match_stats(),
+        'recognition': get_recognition_stats(),
+    }
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def print_report(report, baseline=None):
+    print(f"Commit {report['commit']}: {report['config']['requests']} requests, "
+          f"concurrency {report['config']['concurrency']}")
+    print(f"{'stage':<14}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for stage, stats in report['results']['stages_ms'].items():
+        line = f"{stage:<14}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}"
+        previous = (baseline or {}).get('results', {}).get('stages_ms', {}).get(stage)
+        if previous and previous['p50']:
+            line += f"   p50 {100 * (stats['p50'] - previous['p50']) / previous['p50']:+.1f}% vs {baseline['commit']}"
+        print(line)
+    results = report['results']
+    print(f"throughput {results['throughput_rps']} req/s, peak RSS {results['peak_rss_mb']} MB, statuses {results['statuses']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the appraisal pipeline against local service stand-ins.")
+    parser.add_argument('--requests', type=int, default=40, help="Total pipeline runs")
+    parser.add_argument('--concurrency', type=int, default=4, help="Pipeline runs in flight at once")
+    parser.add_argument('--max-images', type=int, default=50, help="Fixture images taken from uploads/")
+    parser.add_argument('--latency', default='', help="Per-service latency overrides in seconds, e.g. 'ebay=0.8,fx=0.05'")
+    parser.add_argument('--failure-rate', default='', help="Per-service failure probabilities, e.g. 'ebay=0.05'")
+    parser.add_argument('--latency-scale', type=float, default=1.0, help="Multiply every service latency")
+    parser.add_argument('--strategy', default='claude', choices=['claude', 'ocr', 'ocr_fallback'])
+    parser.add_argument('--no-dedupe', dest='dedupe', action='store_false', help="Disable the perceptual-hash cache")
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help="Disable the Redis-backed caches (which include the perceptual-hash cache)")
+    parser.add_argument('--no-exact-match', dest='exact_match', action='store_false',
+                        help="Skip the catalogue store's exact-match lookup and always use the vector search")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the results as JSON to this path")
+    parser.add_argument('--compare', help="A previous --output file to compare against")
+    args = parser.parse_args()
+
+    # Failures are counted in the statuses; keep tracebacks out of the report
+    logging.basicConfig(level=logging.CRITICAL)
+    workdir = tempfile.mkdtemp(prefix='collectorsage-bench-')
+    configure_environment(workdir, args)
+
+    from benchmarks.fakes import make_profiles
+    latencies = dict(DEFAULT_LATENCIES, **parse_overrides(args.latency))
+    profiles = make_profiles(latencies, parse_overrides(args.failure_rate), args.latency_scale, args.seed)
+
+    corpus = load_corpus(args.max_images)
+    client = install_fakes(corpus, profiles, args)
+    results = run_benchmark(corpus, client, args)
+
+    report = {
+        'commit': current_commit(),
+        'config': dict(vars(args), latencies=latencies),
+        'results': results,
+        'cache_stats': collect_cache_stats(),
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,146 @@
 import os
+from dotenv import load_dotenv
+
+load_dotenv()
 
 DATABASE_PATH = r"D:/projects/2024/q3/collectorsage/databases"
-UPLOAD_FOLDER = 'D:/projects/2024/q3/collectorsage/uploads'
\ No newline at end of file
+UPLOAD_FOLDER = 'D:/projects/2024/q3/collectorsage/uploads'
+
+REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+
+GOOGLE_CREDENTIALS_PATH = os.getenv('GOOGLE_CREDENTIALS_PATH', "D:\\projects\\2024\\Q3\\collectorsage\\collectorsage-eec946bf70cd.json")
+EMBEDDING_MODEL_NAME = os.getenv('EMBEDDING_MODEL_NAME', 'all-MiniLM-L6-v2')
+
+# Seconds before a cached exchange rate table is refreshed
+EXCHANGE_RATE_TTL = int(os.getenv('EXCHANGE_RATE_TTL', 3600))
+
+# Concurrency and per-stage time budgets (seconds) for the /process_image pipeline
+PIPELINE_MAX_WORKERS = int(os.getenv('PIPELINE_MAX_WORKERS', 8))
+STAGE_TIMEOUTS = {
+    'database': float(os.getenv('DATABASE_STAGE_TIMEOUT', 10)),
+    'ebay': float(os.getenv('EBAY_STAGE_TIMEOUT', 15)),
+}
+
+# eBay search cache: entries are fresh for EBAY_CACHE_TTL seconds, then served stale
+# for up to EBAY_CACHE_STALE_TTL more seconds while they are refreshed
+EBAY_CACHE_TTL = int(os.getenv('EBAY_CACHE_TTL', 3600))
+EBAY_CACHE_STALE_TTL = int(os.getenv('EBAY_CACHE_STALE_TTL', 86400))
+
+# Report cache: reports are reused for REPORT_CACHE_TTL seconds (0 disables the cache) while the
+# comic's prices stay in the same REPORT_CACHE_PRICE_BUCKET-wide log buckets, at most
+# REPORT_CACHE_MAX_ENTRIES reports are kept. With REPORT_CACHE_MAX_DRIFT above 0, a comic's
+# latest report is also reused until any price moves by more than that fraction.
+REPORT_CACHE_TTL = int(os.getenv('REPORT_CACHE_TTL', 86400))
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv('REPORT_CACHE_MAX_ENTRIES', 10000))
+REPORT_CACHE_PRICE_BUCKET = float(os.getenv('REPORT_CACHE_PRICE_BUCKET', 0.1))
+REPORT_CACHE_MAX_DRIFT = float(os.getenv('REPORT_CACHE_MAX_DRIFT', 0))
+
+# Perceptual-hash index of processed covers, kept in Redis; uploads within
+# IMAGE_HASH_THRESHOLD bits of an indexed cover reuse its recognition result (-1 disables it).
+# The oldest covers are evicted beyond IMAGE_HASH_MAX_ENTRIES.
+IMAGE_HASH_THRESHOLD = int(os.getenv('IMAGE_HASH_THRESHOLD', 6))
+IMAGE_HASH_MAX_ENTRIES = int(os.getenv('IMAGE_HASH_MAX_ENTRIES', 100000))
+
+# How covers are recognized: 'claude' (vision model only), 'ocr' (Google Vision text plus a
+# local parser) or 'ocr_fallback' (local OCR parse, Claude only when confidence is low)
+RECOGNITION_STRATEGY = os.getenv('RECOGNITION_STRATEGY', 'claude')
+OCR_CONFIDENCE_THRESHOLD = float(os.getenv('OCR_CONFIDENCE_THRESHOLD', 0.8))
+
+# Uploads are downscaled so their long edge is at most MAX_IMAGE_EDGE pixels before
+# being sent to the vision models
+MAX_IMAGE_EDGE = int(os.getenv('MAX_IMAGE_EDGE', 1568))
+JPEG_QUALITY = int(os.getenv('JPEG_QUALITY', 85))
+
+# Vector index used for catalogue lookups: 'pinecone' or 'local' (in-process NumPy index
+# stored under LOCAL_INDEX_PATH)
+VECTOR_INDEX_BACKEND = os.getenv('VECTOR_INDEX_BACKEND', 'pinecone')
+LOCAL_INDEX_PATH = os.getenv('LOCAL_INDEX_PATH', 'vector_index')
+
+# On-disk generations (the local vector index and the catalogue store): how often serving
+# processes re-check the CURRENT pointer for a new generation, and how long a superseded
+# generation is kept so processes still reading it can finish and move on
+GENERATION_REFRESH_SECONDS = int(os.getenv('GENERATION_REFRESH_SECONDS', 30))
+GENERATION_RETENTION_SECONDS = int(os.getenv('GENERATION_RETENTION_SECONDS', 600))
+
+# Pinecone namespace used when no shadow build has been activated, and how often workers
+# re-check which namespace is active
+PINECONE_NAMESPACE = os.getenv('PINECONE_NAMESPACE', '')
+NAMESPACE_REFRESH_SECONDS = int(os.getenv('NAMESPACE_REFRESH_SECONDS', 30))
+
+# Content hashes of indexed catalogue entries, used for incremental re-indexing
+INDEX_MANIFEST_PATH = os.getenv('INDEX_MANIFEST_PATH', 'index_manifest.json')
+
+# Columnar copy of the parsed catalogue (memory-mapped NumPy arrays), rebuilt on every
+# upload_vectors run and used for exact issue lookups and price distributions
+CATALOGUE_STORE_PATH = os.getenv('CATALOGUE_STORE_PATH', 'catalogue_store')
+
+# Query embedding cache: in-memory LRU size, and an optional memory-mapped disk tier
+# shared by all worker processes (disabled when EMBEDDING_CACHE_PATH is empty)
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 1024))
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', '')
+EMBEDDING_CACHE_DISK_ENTRIES = int(os.getenv('EMBEDDING_CACHE_DISK_ENTRIES', 65536))
+
+# Outbound HTTP: connections kept alive per host, retries with jittered exponential
+# backoff (a server's Retry-After is honoured up to HTTP_MAX_RETRY_AFTER seconds), (connect,
+# read) timeouts in seconds per attempt, and a deadline in seconds for a whole request
+# including its retries, which keeps it inside the stage budget in STAGE_TIMEOUTS
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 16))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 3))
+HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR', 0.5))
+HTTP_MAX_RETRY_AFTER = float(os.getenv('HTTP_MAX_RETRY_AFTER', 5))
+HTTP_DEFAULT_TIMEOUT = (3.05, 10)
+HTTP_TIMEOUTS = {
+    'api.ebay.com': (3.05, float(os.getenv('EBAY_READ_TIMEOUT', 10))),
+    'api.exchangerate-api.com': (3.05, float(os.getenv('EXCHANGE_RATE_READ_TIMEOUT', 5))),
+}
+HTTP_DEFAULT_DEADLINE = float(os.getenv('HTTP_DEFAULT_DEADLINE', 20))
+HTTP_DEADLINES = {
+    'api.ebay.com': float(os.getenv('EBAY_REQUEST_DEADLINE', 12)),
+    'api.exchangerate-api.com': float(os.getenv('EXCHANGE_RATE_REQUEST_DEADLINE', 6)),
+}
+
+# Vector matches fetched per catalogue lookup before fuzzy reranking
+DATABASE_TOP_K = int(os.getenv('DATABASE_TOP_K', 200))
+
+# Answer catalogue lookups from the catalogue store's exact (normalized series, issue) index
+# when it has the issue, skipping the embedding and vector query
+DATABASE_EXACT_MATCH = os.getenv('DATABASE_EXACT_MATCH', 'true').lower() == 'true'
+
+# Asynchronous jobs: how long job records are kept (seconds), and how often / how long the
+# server-sent events endpoint polls a job
+JOB_TTL = int(os.getenv('JOB_TTL', 86400))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 0.5))
+JOB_EVENTS_TIMEOUT = int(os.getenv('JOB_EVENTS_TIMEOUT', 120))
+# A job still in the processing list this long after its last update is assumed to belong to
+# a crashed worker and is put back on the queue
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', 600))
+
+# Job webhooks must be https. With WEBHOOK_ALLOWED_HOSTS (comma-separated) set, only those
+# hosts are accepted; otherwise any host that resolves only to public addresses is
+WEBHOOK_ALLOWED_HOSTS = [host.strip().lower() for host in os.getenv('WEBHOOK_ALLOWED_HOSTS', '').split(',') if host.strip()]
+# (connect, read) timeouts in seconds for one webhook delivery
+WEBHOOK_TIMEOUT = (3.05, float(os.getenv('WEBHOOK_READ_TIMEOUT', 10)))
+
+# Batch appraisals: books recognized / looked up concurrently, and the most images accepted
+# in one request (as files or inside a zip)
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', 4))
+BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', 200))
+
+# Request size limit (Flask MAX_CONTENT_LENGTH), the largest single image accepted (including
+# each image unpacked from a batch zip), and the highest compression ratio a zip member may
+# claim before it is treated as a zip bomb
+MAX_REQUEST_BYTES = int(os.getenv('MAX_REQUEST_BYTES', 512 * 1024 * 1024))
+UPLOAD_MAX_IMAGE_BYTES = int(os.getenv('UPLOAD_MAX_IMAGE_BYTES', 50 * 1024 * 1024))
+ARCHIVE_MAX_COMPRESSION_RATIO = float(os.getenv('ARCHIVE_MAX_COMPRESSION_RATIO', 100))
+
+# Uploads are spooled in memory up to UPLOAD_SPOOL_MAX_BYTES (then to a temp file) for the
+# length of a request. With UPLOAD_PERSIST, /process_image also keeps a copy in UPLOAD_FOLDER
+# named by its SHA-256 (queued jobs always do). Stored copies older than
+# UPLOAD_RETENTION_SECONDS, or beyond UPLOAD_MAX_BYTES in total, are removed at most every
+# UPLOAD_GC_INTERVAL seconds, except those that queued jobs still need.
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv('UPLOAD_SPOOL_MAX_BYTES', 8 * 1024 * 1024))
+UPLOAD_PERSIST = os.getenv('UPLOAD_PERSIST', 'false').lower() in ('1', 'true', 'yes')
+UPLOAD_RETENTION_SECONDS = int(os.getenv('UPLOAD_RETENTION_SECONDS', 86400))
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', 1024 * 1024 * 1024))
+UPLOAD_GC_INTERVAL = int(os.getenv('UPLOAD_GC_INTERVAL', 300))
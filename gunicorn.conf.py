@@ -0,0 +1,8 @@
+# Import the app in the master process and load the embedding model there, so every
+# forked worker shares the same copy of the model weights copy-on-write.
+# Network clients are still created lazily inside each worker after the fork.
+preload_app = True
+
+def on_starting(server):
+    from utils.resources import warm_up
+    warm_up(['model'])
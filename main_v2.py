@@ -1,19 +1,21 @@
 import os
 import json
+import zipfile
 import logging
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, url_for
+import time
+from flask import Flask, Response, g, request, jsonify, url_for, stream_with_context
 from werkzeug.utils import secure_filename
 from flask_cors import CORS
-from utils.image_processing import process_comic_image
-from utils.report_generation import generate_qualitative_report
-from utils.ebay import fetch_ebay_data, calculate_sales_trend
-from utils.database import fetch_database_info
-from utils.currency_conversion import convert_currency
-from config import UPLOAD_FOLDER
-import anthropic
-import redis
-from datetime import datetime
+from utils.pipeline import appraise_comic, appraise_comic_events
+from utils.resources import get_anthropic_client
+from utils.batch import appraise_collection
+from utils.upload_store import receive, persist, UploadTooLarge
+from utils.jobs import new_job_id, enqueue_job, get_job, validate_webhook_url
+from utils.metrics import start_request, server_timing_header, render_metrics, UPLOAD_BYTES
+from prometheus_client import CONTENT_TYPE_LATEST
+from config import (UPLOAD_FOLDER, JOB_POLL_INTERVAL, JOB_EVENTS_TIMEOUT, BATCH_MAX_IMAGES, UPLOAD_PERSIST, MAX_REQUEST_BYTES,
+                    UPLOAD_MAX_IMAGE_BYTES, ARCHIVE_MAX_COMPRESSION_RATIO)
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG, 
@@ -29,21 +31,16 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Larger requests are refused with 413 before they are read
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
 
 try:
-    # Ensure the environment variable name is correct and print it to verify
-    anthropic_api_key = os.getenv('ANTHROPIC_API_KEY')
-    logging.debug(f"API Key: {anthropic_api_key}")
-    if not anthropic_api_key:
+    # Ensure the environment variable name is correct; the client itself is created on first use
+    if not os.getenv('ANTHROPIC_API_KEY'):
         raise ValueError("API Key is not set.")
 
-    # Initialize the Anthropic client with the API key
-    client = anthropic.Client(api_key=anthropic_api_key)
-
     os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'D:/projects/2024/q3/collectorsage/collectorsage.json'
 
-    cache = redis.Redis(host='localhost', port=6379, db=0)
-
     CLIENT_ID = os.getenv('CLIENT_ID')
     CLIENT_SECRET = os.getenv('CLIENT_SECRET')
     REDIRECT_URI = os.getenv('REDIRECT_URI', 'http://localhost:8000/callback')
@@ -51,6 +48,17 @@ try:
 except Exception as e:
     logging.exception("Failed during startup or dependency injection")
 
+@app.after_request
+def add_server_timing(response):
+    spans = getattr(g, 'spans', None)
+    if spans:
+        response.headers['Server-Timing'] = server_timing_header(spans)
+    return response
+
+@app.get("/metrics")
+def metrics():
+    return Response(render_metrics(), mimetype=CONTENT_TYPE_LATEST)
+
 @app.get("/")
 def root():
     return "Hello, World!"
@@ -68,80 +76,197 @@ def process_image():
     if image.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
-    filename = secure_filename(image.filename)
-    image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    image.save(image_path)
+    g.spans = start_request()
+    UPLOAD_BYTES.inc(request.content_length or 0)
 
+    upload = receive(image.stream, secure_filename(image.filename))
     try:
-        result, search_query = process_comic_image(image_path)
-
-        if result:
-            title = result['title']
-            issue_number = result['issue_number']
-            year = result['year']
-
-            logging.debug(f"Comic details - Title: {title}, Issue Number: {issue_number}, Year: {year}")
-
-            # Fetch database prices and metadata in a single query
-            database_prices, metadata = fetch_database_info(title, issue_number)
-            logging.debug(f"Database Prices: {database_prices}")
-
-            if database_prices:
-                database_avg_price = sum(database_prices) / len(database_prices)
-            else:
-                database_avg_price = 0.0
-
-            logging.debug(f"Database Average Price: £{database_avg_price:.2f}")
+        if UPLOAD_PERSIST:
+            persist(upload, app.config['UPLOAD_FOLDER'])
+        body, status = appraise_comic(upload.open(), get_anthropic_client())
+        return jsonify(body), status
 
-            # Fetch eBay data
-            ebay_data = fetch_ebay_data(search_query)
-            if not ebay_data or 'itemSummaries' not in ebay_data:
-                return jsonify({'error': 'No eBay data found or missing itemSummaries'}), 404
-
-            items = ebay_data.get('itemSummaries', [])
-            items = sorted(items, key=lambda x: float(x['price']['value']), reverse=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.exception("Error processing image")
+        return jsonify({'error': 'An unexpected error occurred'}), 500
+    finally:
+        upload.close()
+    
+@app.route('/process_image/stream', methods=['POST'])
+def process_image_stream():
+    """Appraise an image, streaming details, prices and the report as server-sent events."""
+    if 'image' not in request.files:
+        return jsonify({'error': 'No image file provided'}), 400
 
-            prices = [convert_currency(float(item.get('price', {}).get('value', 0)), item.get('price', {}).get('currency', 'USD')) for item in items if item.get('price', {}).get('value')]
+    image = request.files['image']
+    if image.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
 
-            if not prices:
-                return jsonify({'error': 'No valid prices found'}), 404
+    UPLOAD_BYTES.inc(request.content_length or 0)
+
+    upload = receive(image.stream, secure_filename(image.filename))
+    if UPLOAD_PERSIST:
+        persist(upload, app.config['UPLOAD_FOLDER'])
+    client = get_anthropic_client()
+
+    def events():
+        start_request()
+        try:
+            for event, data in appraise_comic_events(upload.open(), client):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception:
+            logging.exception("Error streaming appraisal")
+            yield f"event: error\ndata: {json.dumps({'error': 'An unexpected error occurred', 'status': 500})}\n\n"
+        finally:
+            upload.close()
+
+    # X-Accel-Buffering stops nginx from holding the events back until the response ends
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+BATCH_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp')
+
+def check_archive_member(info):
+    """Raise UploadTooLarge for a zip member whose declared size or compression ratio is out of bounds."""
+    if info.file_size > UPLOAD_MAX_IMAGE_BYTES:
+        raise UploadTooLarge(f"{info.filename} is larger than {UPLOAD_MAX_IMAGE_BYTES} bytes")
+    if info.file_size > ARCHIVE_MAX_COMPRESSION_RATIO * max(info.compress_size, 1):
+        raise UploadTooLarge(f"{info.filename} is compressed more than {ARCHIVE_MAX_COMPRESSION_RATIO:g}:1")
+
+def receive_batch_uploads():
+    """
+    Spool the images sent as `images` files and/or inside an `archive` zip.
+
+    Returns ([Upload], skipped names). Images past BATCH_MAX_IMAGES are not read and are
+    reported as skipped; an image over UPLOAD_MAX_IMAGE_BYTES (declared or actually read)
+    raises UploadTooLarge.
+    """
+    saved = []
+    skipped = []
+
+    def save(name, stream):
+        if len(saved) >= BATCH_MAX_IMAGES:
+            skipped.append(name)
+            return
+        upload = receive(stream, secure_filename(name), max_bytes=UPLOAD_MAX_IMAGE_BYTES)
+        saved.append(upload)
+        if UPLOAD_PERSIST:
+            persist(upload, app.config['UPLOAD_FOLDER'])
 
-            avg_price = sum(prices) / len(prices)
-            logging.debug(f"Average eBay Price: £{avg_price:.2f}")
+    try:
+        for image in request.files.getlist('images'):
+            if image.filename:
+                save(image.filename, image.stream)
+
+        archive = request.files.get('archive')
+        if archive and archive.filename:
+            with zipfile.ZipFile(archive.stream) as zf:
+                for info in zf.infolist():
+                    name = os.path.basename(info.filename)
+                    if info.is_dir() or not name.lower().endswith(BATCH_IMAGE_EXTENSIONS):
+                        continue
+                    if len(saved) >= BATCH_MAX_IMAGES:
+                        skipped.append(name)
+                        continue
+                    check_archive_member(info)
+                    with zf.open(info) as member:
+                        save(name, member)
+    except Exception:
+        for upload in saved:
+            upload.close()
+        raise
+    return saved, skipped
+
+@app.route('/process_batch', methods=['POST'])
+def process_batch():
+    """Appraise a whole collection: many `images` files and/or an `archive` zip of images."""
+    g.spans = start_request()
+    UPLOAD_BYTES.inc(request.content_length or 0)
 
-            sold_dates = [datetime.strptime(item['itemEndDate'], '%Y-%m-%dT%H:%M:%S.%fZ') for item in items if 'itemEndDate' in item]
-            sales_trend = calculate_sales_trend(sold_dates)
+    try:
+        uploads, skipped = receive_batch_uploads()
+    except zipfile.BadZipFile:
+        return jsonify({'error': 'Archive is not a valid zip file'}), 400
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    if not uploads:
+        return jsonify({'error': 'No image files provided'}), 400
+
+    include_reports = request.form.get('reports', '').lower() in ('1', 'true', 'yes')
+    try:
+        images = [(upload.filename, upload.open()) for upload in uploads]
+        body = appraise_collection(images, get_anthropic_client(), include_reports)
+        if skipped:
+            body['skipped'] = skipped
+        return jsonify(body), 200
+    except Exception:
+        logging.exception("Error processing batch")
+        return jsonify({'error': 'An unexpected error occurred'}), 500
+    finally:
+        for upload in uploads:
+            upload.close()
 
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Store the upload, queue it for a worker and return immediately."""
+    if 'image' not in request.files:
+        return jsonify({'error': 'No image file provided'}), 400
 
-            qualitative_report = generate_qualitative_report(
-                title, 
-                issue_number, 
-                year, 
-                avg_price, 
-                database_avg_price, 
-                ebay_data, 
-                client, 
-                sales_trend,
-                metadata
-            )
+    image = request.files['image']
+    if image.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
 
-            comic_details = {
-                'title': title,
-                'issueNumber': issue_number,
-                'year': year
-            }
-            return jsonify({'comicDetails': comic_details, 'report': qualitative_report})
-        else:
-            return jsonify({'error': 'Failed to process image'}), 500
+    webhook_url = request.form.get('webhook_url')
+    if webhook_url:
+        try:
+            validate_webhook_url(webhook_url)
+        except ValueError as e:
+            return jsonify({'error': f"Invalid webhook_url: {e}"}), 400
+
+    UPLOAD_BYTES.inc(request.content_length or 0)
+
+    job_id = new_job_id()
+    # The worker runs in another process, so queued uploads always go to the shared folder
+    with receive(image.stream, secure_filename(image.filename)) as upload:
+        image_path = persist(upload, app.config['UPLOAD_FOLDER'])
+
+    enqueue_job(job_id, image_path, webhook_url)
+    status_url = url_for('job_status', job_id=job_id)
+    response = jsonify({'jobId': job_id, 'status': 'queued', 'statusUrl': status_url,
+                        'eventsUrl': url_for('job_events', job_id=job_id)})
+    response.headers['Location'] = status_url
+    return response, 202
+
+@app.get("/jobs/<job_id>")
+def job_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.get("/jobs/<job_id>/events")
+def job_events(job_id):
+    """Stream job status changes as server-sent events until the job finishes."""
+    def events():
+        last_status = None
+        deadline = time.time() + JOB_EVENTS_TIMEOUT
+        while time.time() < deadline:
+            job = get_job(job_id)
+            if not job:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            if job['status'] != last_status:
+                last_status = job['status']
+                yield f"event: status\ndata: {json.dumps(job)}\n\n"
+            if job['status'] in ('done', 'failed'):
+                return
+            time.sleep(JOB_POLL_INTERVAL)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
 
-    except FileNotFoundError:
-        return jsonify({'error': 'Image file not found'}), 404
-    except ValueError as e:
-        return jsonify({'error': str(e)}), 400
-    except Exception as e:
-        logging.exception("Error processing image")
-        return jsonify({'error': 'An unexpected error occurred'}), 500
-    
 # Route to list all routes
 @app.get("/routes")
 def list_routes():
@@ -0,0 +1,87 @@
+"""
+Listings extracted from dealer category pages, one case per page layout the extractor handles.
+"""
+import pytest
+from utils.catalogue_pages import ParseStats, extract_listings, parse_price
+
+URL = 'https://www.30thcenturycomics.co.uk/category/test'
+
+def extract(html):
+    stats = ParseStats()
+    listings = list(extract_listings({'url': URL, 'html': html}, stats))
+    return listings, stats
+
+FIELDS = ('series', 'publisher', 'year', 'issue_number', 'condition', 'price')
+
+@pytest.mark.parametrize('html, expected', [
+    # Series heading with a year, then issue lines
+    ("AMAZING ADVENTURES (1970)\n5 VF+ £33 Adams art\n62 App GD/VG £12\n", [
+        ('AMAZING ADVENTURES', '', 1970, 5, 'VF+', 33.0),
+        ('AMAZING ADVENTURES', '', 1970, 62, 'GD/VG', 12.0),
+    ]),
+    # "(Publisher YEAR)" heading
+    ("ASTONISHING (Atlas 1951)\n3 VG £120\n", [
+        ('ASTONISHING', 'Atlas', 1951, 3, 'VG', 120.0),
+    ]),
+    # Bare year after the heading, and a heading suffix that belongs to the title
+    ("BEANO 1963\n12 FN £3\nFANTASTIC FOUR (2nd series)\n1 NM £3\n", [
+        ('BEANO', '', 1963, 12, 'FN', 3.0),
+        ('FANTASTIC FOUR (2nd series)', '', 0, 1, 'NM', 3.0),
+    ]),
+    # Title heading, publisher and year detail line, then a grade and price
+    ("THE ENDANGERED MAD\nWarner 1984 US PB\nGD £4\n", [
+        ('THE ENDANGERED MAD', 'Warner', 1984, 0, 'GD', 4.0),
+    ]),
+    # Annuals listed by year take it as their year
+    ("BEANO BOOK\n1965 VG £20\n", [
+        ('BEANO BOOK', '', 1965, 1965, 'VG', 20.0),
+    ]),
+    # Picture captions and the A-Z navigation bar are not headings or items
+    ("A B C\nX-MEN (1963)\nBUNTY #3 VG+\nLION 1954 FN/VF\n1 GD £900\n", [
+        ('X-MEN', '', 1963, 1, 'GD', 900.0),
+    ]),
+    # Grade lines only count inside a heading/detail block
+    ("AVENGERS (1963)\n4 VG £40\nGD £4\n", [
+        ('AVENGERS', '', 1963, 4, 'VG', 40.0),
+    ]),
+    # Priced lines before any heading have no series to belong to
+    ("5 VF £10\nHULK (1962)\n2 FN £300\n", [
+        ('HULK', '', 1962, 2, 'FN', 300.0),
+    ]),
+])
+def test_layouts(html, expected):
+    listings, _ = extract(html)
+    assert [tuple(listing[field] for field in FIELDS) for listing in listings] == expected
+
+def test_notes_and_pence_copies():
+    listings, _ = extract("AMAZING ADVENTURES (1970)\n5 FN+ p £13.75 Adams art\n6 FN £9\n")
+    assert [(listing['pence_copy'], listing['notes']) for listing in listings] == [(True, 'Adams art'), (False, '')]
+    assert listings[0]['full_title'] == 'AMAZING ADVENTURES (1970) #5 FN+'
+
+def test_reduced_price_keeps_current_price():
+    listings, _ = extract("AVENGERS (1963)\n8 VG was £5 now £2.50\n9 VG £4\n")
+    assert (listings[0]['price'], listings[0]['was_price']) == (2.5, 5.0)
+    assert 'was_price' not in listings[1]
+
+def test_identical_lines_get_distinct_ids():
+    listings, _ = extract("AVENGERS (1963)\n4 VG £40\n4 VG £40\n4 FN £60\n")
+    ids = [listing['listing_id'] for listing in listings]
+    assert ids == [f"{URL}#AVENGERS_4_1963_VG_1", f"{URL}#AVENGERS_4_1963_VG_2", f"{URL}#AVENGERS_4_1963_FN_1"]
+
+def test_ids_are_stable_across_runs():
+    html = "AVENGERS (1963)\n4 VG £40\n4 VG £40\n"
+    assert [listing['listing_id'] for listing in extract(html)[0]] == [listing['listing_id'] for listing in extract(html)[0]]
+
+def test_parse_coverage_counts_priced_lines():
+    _, stats = extract("AVENGERS (1963)\n4 VG £40\nSee our £5 bargain box\nGD £4\n")
+    assert (stats.entries, stats.candidates, stats.records) == (1, 3, 1)
+    assert stats.coverage == pytest.approx(1 / 3)
+
+@pytest.mark.parametrize('raw, expected', [
+    ('33', 33.0),
+    ('2,800', 2800.0),
+    ('4..50', 4.5),
+    ('12.', 12.0),
+])
+def test_parse_price(raw, expected):
+    assert parse_price(raw) == expected
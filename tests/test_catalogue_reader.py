@@ -0,0 +1,80 @@
+"""
+Streaming catalogue entries out of JSON arrays, JSON Lines and their gzip-compressed forms.
+"""
+import gzip
+import json
+import pytest
+from utils import catalogue_reader
+from utils.catalogue_reader import find_catalogue_files, iter_catalogue_file
+
+ENTRIES = [
+    {'title': 'Avengers #4', 'price': '£40', 'url': 'https://example.com/1'},
+    {'title': 'Brackets [and] "quotes", commas', 'price': 12.5, 'nested': {'list': [1, 2, {'deep': None}]}},
+    {'title': 'Unicode – £ ü', 'price': 7},
+]
+
+def write_catalogue(path, entries, lines=False):
+    text = ''.join(json.dumps(entry) + '\n' for entry in entries) if lines else json.dumps(entries, indent=1)
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'wt', encoding='utf-8') as f:
+        f.write(text)
+    return str(path)
+
+@pytest.fixture(params=['builtin', 'ijson'])
+def array_parser(request, monkeypatch):
+    """Run array cases with the incremental decoder, in chunks small enough to split entries, and with ijson."""
+    if request.param == 'ijson':
+        if catalogue_reader.ijson is None:
+            pytest.skip("ijson is not installed")
+    else:
+        monkeypatch.setattr(catalogue_reader, 'ijson', None)
+        monkeypatch.setattr(catalogue_reader, 'CHUNK_SIZE', 7)
+    return request.param
+
+@pytest.mark.parametrize('name', ['catalogue.json', 'catalogue.json.gz'])
+def test_json_array(tmp_path, array_parser, name):
+    path = write_catalogue(tmp_path / name, ENTRIES)
+    assert list(iter_catalogue_file(path)) == ENTRIES
+
+@pytest.mark.parametrize('name', ['catalogue.jsonl', 'catalogue.jsonl.gz'])
+def test_json_lines(tmp_path, name):
+    path = write_catalogue(tmp_path / name, ENTRIES, lines=True)
+    assert list(iter_catalogue_file(path)) == ENTRIES
+
+def test_json_lines_skip_blank_and_malformed_lines(tmp_path):
+    path = tmp_path / 'catalogue.jsonl'
+    path.write_text(f"{json.dumps(ENTRIES[0])}\n\n{{not json\n{json.dumps(ENTRIES[1])}\n", encoding='utf-8')
+    assert list(iter_catalogue_file(str(path))) == ENTRIES[:2]
+
+@pytest.mark.parametrize('text, expected', [
+    ('[]', []),
+    (' \n[ ]\n', []),
+    ('[1, 2.5, 30]', [1, 2.5, 30]),
+    ('[{"a": 1},{"b": "]"}]', [{'a': 1}, {'b': ']'}]),
+])
+def test_json_array_edge_cases(tmp_path, array_parser, text, expected):
+    path = tmp_path / 'catalogue.json'
+    path.write_text(text, encoding='utf-8')
+    assert list(iter_catalogue_file(str(path))) == expected
+
+@pytest.mark.parametrize('text', ['{"not": "an array"}', '[{"a": 1}, {"b": 2'])
+def test_bad_arrays_stop_the_file_without_raising(tmp_path, monkeypatch, text):
+    monkeypatch.setattr(catalogue_reader, 'ijson', None)
+    path = tmp_path / 'catalogue.json'
+    path.write_text(text, encoding='utf-8')
+    assert list(iter_catalogue_file(str(path))) == ([{'a': 1}] if text.startswith('[') else [])
+
+@pytest.mark.parametrize('name', ['catalogue.json', 'catalogue.json.gz', 'catalogue.jsonl'])
+def test_progress_adds_up_to_the_file_size(tmp_path, name):
+    path = write_catalogue(tmp_path / name, ENTRIES, lines=name.endswith('.jsonl'))
+    consumed = []
+    list(iter_catalogue_file(path, consumed.append))
+    assert sum(consumed) == (tmp_path / name).stat().st_size
+
+def test_find_catalogue_files(tmp_path):
+    (tmp_path / 'nested').mkdir()
+    for name in ('a.json', 'b.jsonl.gz', 'nested/c.jsonl', 'nested/d.json.gz', 'notes.txt'):
+        (tmp_path / name).write_text('[]', encoding='utf-8')
+    expected = sorted(str(tmp_path / name) for name in ('a.json', 'b.jsonl.gz', 'nested/c.jsonl', 'nested/d.json.gz'))
+    assert find_catalogue_files(str(tmp_path)) == expected
+    assert find_catalogue_files([str(tmp_path / 'a.json'), str(tmp_path / 'notes.txt')]) == [str(tmp_path / 'a.json')]
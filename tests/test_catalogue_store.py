@@ -0,0 +1,99 @@
+"""
+Exact lookups in the columnar catalogue store, and telling printings of an issue apart by year.
+"""
+import pytest
+from utils.catalogue_store import CatalogueStore, CatalogueStoreWriter, issue_key, year_key
+from utils.generations import current_generation
+
+def record(series, issue, year, price, condition='VG'):
+    return {'series': series, 'normalized_series': series.lower(), 'issue_number': issue, 'year': year,
+            'price': price, 'condition': condition}
+
+RECORDS = {
+    # One series and issue covering two printings, decades apart
+    'spellbound-1952': record('Spellbound', 6, 1952, 15.0),
+    'spellbound-1976': record('Spellbound', 6, 1976, 7.5),
+    'spellbound-1976-fn': record('Spellbound', 6, 1976, 9.0, condition='FN'),
+    # A single printing
+    'avengers-a': record('Avengers', 4, 1964, 40.0),
+    'avengers-b': record('Avengers', 4, 1964, 60.0, condition='FN'),
+    # No year recorded for any copy
+    'beano': record('Beano', 12, 0, 3.0),
+    # Known and unknown years mixed within one printing
+    'hulk-dated': record('Hulk', 2, 1962, 300.0),
+    'hulk-undated': record('Hulk', 2, 0, 250.0),
+    # Listings whose issue could not be parsed are stored as issue 0
+    'unparsed': record('Avengers', 0, 1999, 5.0),
+}
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('catalogue_store'))
+    writer = CatalogueStoreWriter(path)
+    for comic_id, fields in RECORDS.items():
+        writer.add(comic_id, fields)
+    writer.save()
+    return CatalogueStore(current_generation(path))
+
+def selected_ids(store, series, issue, year=None):
+    return sorted(store.ids[position] for position in store.select(series, issue, year))
+
+@pytest.mark.parametrize('series, issue, year, expected', [
+    # The year picks one printing
+    ('spellbound', 6, '1952', ['spellbound-1952']),
+    ('spellbound', '6', 1976, ['spellbound-1976', 'spellbound-1976-fn']),
+    # Without a year, several printings cannot be told apart
+    ('spellbound', 6, None, []),
+    ('spellbound', 6, '', []),
+    # A year with no printing matches nothing
+    ('spellbound', 6, '1980', []),
+    # One printing needs no year
+    ('avengers', 4, None, ['avengers-a', 'avengers-b']),
+    ('avengers', 4, '1964', ['avengers-a', 'avengers-b']),
+    # When no copy records a year, every copy matches whatever the year
+    ('beano', 12, None, ['beano']),
+    ('beano', 12, '1963', ['beano']),
+    # Copies without a year only join a printing when none have one
+    ('hulk', 2, '1962', ['hulk-dated']),
+    ('hulk', 2, None, ['hulk-dated', 'hulk-undated']),
+    # Recognized years are often written loosely
+    ('spellbound', 6, '1976 (reprint)', ['spellbound-1976', 'spellbound-1976-fn']),
+    # Unknown series and unkeyable issues
+    ('spellbinders', 6, '1952', []),
+    ('avengers', '1/2', '1999', []),
+    ('avengers', 0, '1999', []),
+])
+def test_select(store, series, issue, year, expected):
+    assert selected_ids(store, series, issue, year) == expected
+
+def test_records_for_a_selection(store):
+    [copy] = store.records(store.select('spellbound', 6, '1952'))
+    assert (copy['id'], copy['title'], copy['issue_number'], copy['year'], copy['price']) == \
+        ('spellbound-1952', 'Spellbound', 6, 1952, 15.0)
+
+def test_price_distribution_follows_the_year(store):
+    assert store.price_distribution('spellbound', 6, '1952')['count'] == 1
+    distribution = store.price_distribution('spellbound', 6, '1976', by='condition')
+    assert (distribution['count'], distribution['mean']) == (2, 8.25)
+    assert set(distribution['by_condition']) == {'VG', 'FN'}
+    assert store.price_distribution('spellbound', 6) is None
+
+def test_later_records_replace_earlier_ones_with_the_same_id(tmp_path):
+    writer = CatalogueStoreWriter(str(tmp_path))
+    writer.add('avengers-a', record('Avengers', 4, 1964, 40.0))
+    writer.add('avengers-a', record('Avengers', 4, 1964, 45.0))
+    assert writer.save() == 1
+    store = CatalogueStore(current_generation(str(tmp_path)))
+    assert [copy['price'] for copy in store.records(store.select('avengers', 4))] == [45.0]
+
+@pytest.mark.parametrize('value, expected', [
+    (6, 6), ('6', 6), (' 6.0 ', 6), ('1/2', None), ('8.5', None), ('', None), (0, None), (-3, None),
+])
+def test_issue_key(value, expected):
+    assert issue_key(value) == expected
+
+@pytest.mark.parametrize('value, expected', [
+    (1952, 1952), ('1952', 1952), ('1976 (reprint)', 1976), ('', None), (None, None), (0, None), ('52', None),
+])
+def test_year_key(value, expected):
+    assert year_key(value) == expected
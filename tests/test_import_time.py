@@ -0,0 +1,37 @@
+"""
+Importing the app must stay cheap: models and API clients are created lazily by
+utils.resources, so worker boot and test collection never load them.
+"""
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_BUDGET_SECONDS = 2.0
+HEAVY_MODULES = ('torch', 'sentence_transformers', 'anthropic', 'pinecone', 'google.cloud.vision')
+
+PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import main_v2
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed, 'loaded': [name for name in {HEAVY_MODULES!r} if name in sys.modules]}}))
+"""
+
+def import_main(tmp_path):
+    # A fresh interpreter, run from a scratch directory since the app creates its log and upload folder there
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, ANTHROPIC_API_KEY='test')
+    completed = subprocess.run([sys.executable, '-c', PROBE], cwd=tmp_path, env=env,
+                               capture_output=True, text=True, timeout=60)
+    assert completed.returncode == 0, completed.stderr
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def test_import_loads_no_models_or_clients(tmp_path):
+    assert import_main(tmp_path)['loaded'] == []
+
+def test_import_within_budget(tmp_path):
+    # Take the best of a few runs so a busy machine doesn't fail the budget
+    elapsed = min(import_main(tmp_path)['elapsed'] for _ in range(3))
+    assert elapsed < IMPORT_BUDGET_SECONDS, f"importing main_v2 took {elapsed:.2f}s"
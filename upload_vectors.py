@@ -1,12 +1,27 @@
 import os
 import json
 import logging
-from sentence_transformers import SentenceTransformer
+import argparse
+import collections
+import multiprocessing
+import queue
+import threading
+import time
+import hashlib
 from unidecode import unidecode
 from tqdm import tqdm
 from dotenv import load_dotenv
-from pinecone import Pinecone, ServerlessSpec
 import re
+from urllib.parse import urlparse
+import redis
+from config import (VECTOR_INDEX_BACKEND, LOCAL_INDEX_PATH, DATABASE_PATH, PINECONE_NAMESPACE,
+                    NAMESPACE_REFRESH_SECONDS, INDEX_MANIFEST_PATH)
+from utils.vector_index import LocalIndex, get_index, activate_namespace
+from utils.database import title_features
+from utils.catalogue_pages import extract_listings, ParseStats
+from utils.catalogue_reader import find_catalogue_files, iter_catalogue_file
+from utils.catalogue_store import CatalogueStoreWriter
+from utils.resources import get_model
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG, 
@@ -17,31 +32,6 @@ logging.basicConfig(level=logging.DEBUG,
 # Load environment variables
 load_dotenv()
 
-# Initialize Pinecone
-api_key = os.getenv('PINECONE_API_KEY')
-index_name = os.getenv('PINECONE_INDEX_NAME')
-environment = os.getenv('PINECONE_ENVIRONMENT')
-
-# Create an instance of Pinecone
-pc = Pinecone(api_key=api_key)
-
-# Check if the index exists
-if index_name in pc.list_indexes().names():
-    pc.delete_index(index_name)
-
-pc.create_index(
-    name=index_name,
-    dimension=384,
-    metric='cosine',
-    spec=ServerlessSpec(cloud='aws', region='us-east-1')
-)
-index = pc.Index(index_name)
-logging.info(f"Pinecone index '{index_name}' created successfully.")
-
-# Load pre-trained model
-model = SentenceTransformer('all-MiniLM-L6-v2')
-logging.info("Model loaded successfully.")
-
 def parse_comic_entry(entry):
     title = entry.get('title', '')
     match = re.match(r"(.*?):? (.*?) \((\d{4})\) By (.*?) Volume (\d+),(\d+)(.*?)(?:\s*\(.*?\))?", title)
@@ -70,9 +60,11 @@ def parse_comic_entry(entry):
         else:
             logging.warning(f"Unable to extract price from: {price_str}")
 
+    series = series.strip() if series else ""
     return {
         "title": comic_title.strip(),
-        "series": series.strip() if series else "",
+        "series": series,
+        **title_features(series),
         "year": int(year),
         "publisher": publisher.strip(),
         "volume": int(volume),
@@ -83,58 +75,359 @@ def parse_comic_entry(entry):
         "full_title": title  # Keep the full title for reference
     }
 
-# Utility function to read and validate JSON data
-def load_json(file_path):
+def create_index():
+    """Recreate the target vector index from scratch."""
+    if VECTOR_INDEX_BACKEND == 'local':
+        index = LocalIndex()
+        index.delete(delete_all=True)
+        logging.info(f"Local vector index at '{LOCAL_INDEX_PATH}' will be rebuilt.")
+        return index
+
+    api_key = os.getenv('PINECONE_API_KEY')
+    index_name = os.getenv('PINECONE_INDEX_NAME')
+
+    from pinecone import Pinecone, ServerlessSpec
+
+    # Create an instance of Pinecone
+    pc = Pinecone(api_key=api_key)
+
+    # Check if the index exists
+    if index_name in pc.list_indexes().names():
+        pc.delete_index(index_name)
+
+    pc.create_index(
+        name=index_name,
+        dimension=384,
+        metric='cosine',
+        spec=ServerlessSpec(cloud='aws', region='us-east-1')
+    )
+    logging.info(f"Pinecone index '{index_name}' created successfully.")
+    # Queries follow the active namespace, which may still name a shadow build from the old index
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        logging.error(f"Error reading JSON file {file_path}: {e}")
-        return None
+        activate_namespace(PINECONE_NAMESPACE)
+    except redis.exceptions.RedisError as e:
+        logging.warning(f"Unable to reset the active namespace to '{PINECONE_NAMESPACE}' in Redis: {e}")
+    return get_index(namespace=PINECONE_NAMESPACE)
+
+def load_manifest():
+    if not os.path.exists(INDEX_MANIFEST_PATH):
+        return {}
+    with open(INDEX_MANIFEST_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest):
+    tmp_path = f"{INDEX_MANIFEST_PATH}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, INDEX_MANIFEST_PATH)
+
+def content_hash(parsed_comic):
+    return hashlib.sha256(json.dumps(parsed_comic, sort_keys=True).encode('utf-8')).hexdigest()
 
-# Load JSON files
-db_path = r"D:\projects\2024\Q3\collectorsage\databases"
-json_files = [os.path.join(db_path, f) for f in os.listdir(db_path) if f.endswith('.json')]
-logging.info(f"Found {len(json_files)} JSON files in the database directory.")
+# Sources whose entries are whole category pages listing many items each
+CATEGORY_PAGE_SOURCES = ('30thcenturycomics.co.uk',)
 
-# Process each JSON file
-batch_size = 50
-for json_file in tqdm(json_files, desc="Processing JSON files"):
-    comic_data = load_json(json_file)
-    if not comic_data:
-        continue
+def entry_source(entry):
+    # Some scrapes keep the quotes around the URL
+    return urlparse(entry.get('url', '').strip("'\"")).hostname or 'unknown'
 
+def parse_entry(entry, coverage):
+    """Yield the catalogue records in one scraped entry, counting parse coverage per source."""
+    source = entry_source(entry)
+    stats = coverage.setdefault(source, ParseStats())
+    if source.endswith(CATEGORY_PAGE_SOURCES):
+        for listing in extract_listings(entry, stats):
+            listing.update(title_features(listing['series']))
+            yield listing
+        return
+
+    stats.entries += 1
+    stats.candidates += 1
+    parsed_comic = parse_comic_entry(entry)
+    if parsed_comic:
+        stats.records += 1
+        yield parsed_comic
+
+def log_parse_coverage(coverage):
+    for source, stats in sorted(coverage.items()):
+        logging.info(f"Parse coverage for {source}: {stats.records}/{stats.candidates} items "
+                     f"({stats.coverage:.1%}) from {stats.entries} entries")
+
+def iter_parsed_entries(json_files):
+    """Lazily yield parsed catalogue entries, streaming each file one entry at a time."""
+    coverage = {}
+    total_bytes = sum(os.path.getsize(json_file) for json_file in json_files)
+    with tqdm(total=total_bytes, unit='B', unit_scale=True, desc="Reading catalogue files") as progress:
+        for json_file in json_files:
+            for comic in iter_catalogue_file(json_file, progress.update):
+                yield from parse_entry(comic, coverage)
+    log_parse_coverage(coverage)
+
+def track_store(entries, store):
+    """Pass entries through while adding them to the columnar catalogue store."""
+    return store.track(entries, make_comic_id, entry_source)
+
+def iter_batches(iterable, size):
     batch = []
-    for comic in tqdm(comic_data, desc=f"Uploading Vectors from {json_file}", leave=False):
-        parsed_comic = parse_comic_entry(comic)
-        if not parsed_comic:
-            continue
-
-        vector = model.encode(parsed_comic['full_title'])
-        
-        # Create a unique ID
-        comic_id = f"{parsed_comic['title']}_{parsed_comic['issue_number']}_{parsed_comic['year']}"
-        comic_id = unidecode(comic_id)  # Remove any non-ASCII characters
-
-        batch.append({"id": comic_id, "values": vector.tolist(), "metadata": parsed_comic})
-        
-        if len(batch) >= batch_size:
-            try:
-                response = index.upsert(vectors=batch)
-                logging.debug(f"Upsert response: {response}")
-            except Exception as e:
-                logging.error(f"Error upserting batch: {e}")
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
             batch = []
-
     if batch:
+        yield batch
+
+def make_comic_id(parsed_comic):
+    # Listings extracted from category pages carry their own stable ID
+    if 'listing_id' in parsed_comic:
+        return parsed_comic['listing_id']
+    # Create a unique ID
+    comic_id = f"{parsed_comic['title']}_{parsed_comic['issue_number']}_{parsed_comic['year']}"
+    return unidecode(comic_id)  # Remove any non-ASCII characters
+
+def make_vector_record(parsed_comic, vector):
+    return {"id": make_comic_id(parsed_comic), "values": vector.tolist(), "metadata": parsed_comic}
+
+def record_hash(manifest, comic_id, digest):
+    """Record an entry's content hash; an ID seen more than once keeps every occurrence's hash, in order."""
+    recorded = manifest.get(comic_id)
+    if recorded is None:
+        manifest[comic_id] = digest
+    elif isinstance(recorded, list):
+        recorded.append(digest)
+    else:
+        manifest[comic_id] = [recorded, digest]
+
+def _last_hash(recorded):
+    return recorded[-1] if isinstance(recorded, list) else recorded
+
+def diff_against_manifest(entries, manifest, current):
+    """
+    Pass through only the entries that are new or changed since the manifest was saved.
+
+    Records every entry's content hash in `current` as it goes, so once the entries are
+    exhausted `current` is the new manifest and IDs in `manifest` but not in `current` have
+    vanished. With upsert semantics the last entry seen for an ID is the one indexed, so an
+    ID that repeats is compared with its previous entry; IDs the manifest already knows to
+    repeat are held back and passed through at the end if any of their entries changed.
+    """
+    held = {}
+    for parsed_comic in entries:
+        comic_id = make_comic_id(parsed_comic)
+        digest = content_hash(parsed_comic)
+        previous = current.get(comic_id)
+        record_hash(current, comic_id, digest)
+        if isinstance(manifest.get(comic_id), list):
+            held[comic_id] = parsed_comic
+        elif digest != _last_hash(previous if previous is not None else manifest.get(comic_id)):
+            yield parsed_comic
+    for comic_id, parsed_comic in held.items():
+        if current[comic_id] != manifest[comic_id]:
+            yield parsed_comic
+
+def drop_failed(manifest, failed_ids):
+    """Forget entries whose upsert failed, so the next incremental run uploads them again."""
+    for comic_id in failed_ids:
+        manifest.pop(comic_id, None)
+    if failed_ids:
+        logging.error(f"{len(failed_ids)} entries failed to upload and were left out of the manifest.")
+
+def track_manifest(entries, manifest):
+    """Pass entries through while recording their content hashes in the manifest."""
+    for parsed_comic in entries:
+        record_hash(manifest, make_comic_id(parsed_comic), content_hash(parsed_comic))
+        yield parsed_comic
+
+def rebuild(model, json_files, args):
+    """Delete and recreate the index, then upload every entry."""
+    index = create_index()
+    manifest = {}
+    store = CatalogueStoreWriter()
+    entries = track_manifest(track_store(iter_parsed_entries(json_files), store), manifest)
+    total, failed_ids = upload_entries(index, model, entries, args.encode_batch_size, args.upsert_batch_size,
+                                       args.queue_size, args.workers)
+    drop_failed(manifest, failed_ids)
+    if VECTOR_INDEX_BACKEND == 'local':
+        index.save()
+    store.save()
+    save_manifest(manifest)
+    return index, total
+
+def build_shadow(model, json_files, args):
+    """Build a complete copy of the catalogue out of sight of queries, then swap it in."""
+    if VECTOR_INDEX_BACKEND == 'local':
+        # LocalIndex.save already writes a new generation and swaps it in atomically
+        index = LocalIndex()
+        index.delete(delete_all=True)
+    else:
+        namespace = f"build-{int(time.time())}"
+        index = get_index(namespace=namespace)
+        logging.info(f"Building shadow namespace '{namespace}'.")
+
+    manifest = {}
+    store = CatalogueStoreWriter()
+    entries = track_manifest(track_store(iter_parsed_entries(json_files), store), manifest)
+    total, failed_ids = upload_entries(index, model, entries, args.encode_batch_size, args.upsert_batch_size,
+                                       args.queue_size, args.workers)
+    drop_failed(manifest, failed_ids)
+
+    # The store is written now but only made current alongside the new vectors, so the
+    # exact-match fast path and the vector fallback always serve the same catalogue
+    store_generation = store.write()
+    if VECTOR_INDEX_BACKEND == 'local':
+        index.save()
+        store.publish(store_generation)
+    else:
+        previous = activate_namespace(namespace)
+        store.publish(store_generation)
+        logging.info(f"Activated namespace '{namespace}' (was '{previous}').")
+        # Give workers time to pick up the new namespace before dropping the old one
+        time.sleep(NAMESPACE_REFRESH_SECONDS)
+        get_index(namespace=previous).delete(delete_all=True)
+    save_manifest(manifest)
+    return index, total
+
+def update_incrementally(model, json_files, args):
+    """Embed and upsert only new or changed entries, and delete entries that have vanished."""
+    index = get_index()
+    # The store is cheap to rebuild, so it is always written in full from the parsed catalogue
+    store = CatalogueStoreWriter()
+    previous = load_manifest()
+    manifest = {}
+    changed = diff_against_manifest(track_store(iter_parsed_entries(json_files), store), previous, manifest)
+    total, failed_ids = upload_entries(index, model, changed, args.encode_batch_size, args.upsert_batch_size,
+                                       args.queue_size, args.workers)
+    vanished = [comic_id for comic_id in previous if comic_id not in manifest]
+    logging.info(f"Incremental update: {total + len(failed_ids)} new or changed, {len(vanished)} vanished.")
+
+    drop_failed(manifest, failed_ids)
+    for start in range(0, len(vanished), 1000):
+        index.delete(ids=vanished[start:start + 1000])
+
+    if VECTOR_INDEX_BACKEND == 'local':
+        index.save()
+    store.save()
+    save_manifest(manifest)
+    return index, total
+
+def upsert_worker(index, upsert_queue, failed_ids):
+    """Upsert batches from the queue until the None sentinel arrives, collecting the IDs of failed batches."""
+    while True:
+        batch = upsert_queue.get()
+        if batch is None:
+            break
         try:
             response = index.upsert(vectors=batch)
-            logging.debug(f"Final batch upsert response: {response}")
+            logging.debug(f"Upsert response: {response}")
         except Exception as e:
-            logging.error(f"Error upserting final batch: {e}")
+            logging.error(f"Error upserting batch: {e}")
+            failed_ids.update(record['id'] for record in batch)
+
+def _init_encode_worker(threads):
+    # Split the cores between processes instead of every worker claiming all of them
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    get_model()
+
+def _encode_titles(titles, batch_size):
+    return get_model().encode(titles, batch_size=batch_size)
+
+def iter_encoded_batches(model, entries, encode_batch_size, workers=1):
+    """
+    Yield (batch, vectors) for consecutive batches of entries, in order.
+
+    With more than one worker, batches are encoded by a process pool whose workers each load
+    the model once. Parsing stays in this process, and at most two batches per worker are in
+    flight so a large catalogue is never read ahead into memory.
+    """
+    batches = iter_batches(entries, encode_batch_size)
+    if workers <= 1:
+        for batch in batches:
+            yield batch, model.encode([parsed_comic['full_title'] for parsed_comic in batch], batch_size=encode_batch_size)
+        return
+
+    threads = max(1, (os.cpu_count() or workers) // workers)
+    # spawn rather than fork: the model libraries do not survive forking a threaded parent
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=_init_encode_worker, initargs=(threads,)) as pool:
+        pending = collections.deque()
+        for batch in batches:
+            titles = [parsed_comic['full_title'] for parsed_comic in batch]
+            pending.append((batch, pool.apply_async(_encode_titles, (titles, encode_batch_size))))
+            if len(pending) >= workers * 2:
+                batch, result = pending.popleft()
+                yield batch, result.get()
+        while pending:
+            batch, result = pending.popleft()
+            yield batch, result.get()
+
+def upload_entries(index, model, entries, encode_batch_size, upsert_batch_size, queue_size, workers=1):
+    """
+    Encode entries in batches and upsert them, overlapping the two.
+
+    Encoding runs on the calling thread (or on `workers` processes) while a single writer
+    thread drains a bounded queue of upsert batches, so a slow upsert only stalls encoding
+    once the queue is full. Returns (vectors uploaded, IDs of entries whose upsert failed).
+    """
+    upsert_queue = queue.Queue(maxsize=queue_size)
+    failed_ids = set()
+    writer = threading.Thread(target=upsert_worker, args=(index, upsert_queue, failed_ids), daemon=True)
+    writer.start()
+
+    total = 0
+    try:
+        for batch, vectors in iter_encoded_batches(model, entries, encode_batch_size, workers):
+            records = [make_vector_record(parsed_comic, vector) for parsed_comic, vector in zip(batch, vectors)]
+            for upsert_batch in iter_batches(records, upsert_batch_size):
+                upsert_queue.put(upsert_batch)
+            total += len(records)
+    finally:
+        upsert_queue.put(None)
+        writer.join()
+    return total - len(failed_ids), failed_ids
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed catalogue entries and upload them to the vector index.")
+    parser.add_argument('--db-path', nargs='+', default=[DATABASE_PATH],
+                        help="Catalogue files (.json, .jsonl, .json.gz, .jsonl.gz) or directories containing them")
+    parser.add_argument('--encode-batch-size', type=int, default=256, help="Entries per model.encode call")
+    parser.add_argument('--upsert-batch-size', type=int, default=50, help="Vectors per upsert request")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Processes encoding batches in parallel, each with its own copy of the model")
+    parser.add_argument('--queue-size', type=int, default=8, help="Maximum upsert batches waiting to be written")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only embed new or changed entries and delete vanished ones, using the manifest")
+    parser.add_argument('--shadow', action='store_true',
+                        help="Rebuild into a shadow namespace and swap it in when complete")
+    args = parser.parse_args()
+
+    # With a process pool the workers load their own copies of the model
+    model = None
+    if args.workers <= 1:
+        model = get_model()
+        logging.info("Model loaded successfully.")
+
+    json_files = find_catalogue_files(args.db_path)
+    logging.info(f"Found {len(json_files)} catalogue files.")
+
+    start = time.perf_counter()
+    if args.incremental:
+        index, total = update_incrementally(model, json_files, args)
+    elif args.shadow:
+        index, total = build_shadow(model, json_files, args)
+    else:
+        index, total = rebuild(model, json_files, args)
+    elapsed = time.perf_counter() - start
+
+    # Confirm all vectors are uploaded
+    logging.info("Checking index status...")
+    index_stats = index.describe_index_stats()
+    logging.info(f"Index contains {index_stats['total_vector_count']} vectors.")
+    logging.info("All vectors uploaded successfully.")
+    print(f"Uploaded {total} entries in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} entries/s)")
 
-# Confirm all vectors are uploaded
-logging.info("Checking index status...")
-index_stats = index.describe_index_stats()
-logging.info(f"Index contains {index_stats['total_vector_count']} vectors.")
-logging.info("All vectors uploaded successfully.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.pipeline import AppraisalError, recognize_comic, gather_market_data, comic_details_view, price_summary
+from utils.report_generation import generate_qualitative_report
+from utils.database import warm_embeddings, has_exact_match
+from utils.ebay import normalize_query
+from config import BATCH_MAX_WORKERS
+
+# Separate from the pipeline pool: batch tasks block on run_stages, which needs that pool free
+executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix='batch')
+
+def _map(func, items):
+    """Run func over items on the batch pool, keeping the caller's context for spans."""
+    futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+    return [future.result() for future in futures]
+
+def _recognize(image):
+    timings = {}
+    try:
+        details, search_query = recognize_comic(image, timings)
+        return details, search_query, None
+    except AppraisalError as e:
+        return None, None, (e.body, e.status)
+    except Exception as e:
+        logging.exception("Error recognizing batch image")
+        return None, None, ({'error': str(e)}, 500)
+
+def appraise_collection(images, client, include_reports=False):
+    """
+    Appraise many images at once.
+
+    `images` is a list of (name, image), each image a path, bytes or binary file object. Recognition runs with bounded parallelism; books
+    that resolve to the same comic share a single database and eBay lookup (and report), and
+    the query embeddings for all distinct comics are encoded in one batch. Returns the
+    response body with a result per book and totals for the collection.
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    recognized = _map(_recognize, [image for _, image in images])
+    timings['recognition'] = round((time.perf_counter() - start) * 1000, 1)
+
+    # Books with the same normalized search query are the same comic
+    comics = {}
+    for details, search_query, failure in recognized:
+        if details:
+            comics.setdefault(normalize_query(search_query), (details, search_query))
+
+    start = time.perf_counter()
+    # Comics in the exact-match index never need their title embedded
+    warm_embeddings([details['title'] for details, _ in comics.values()
+                     if not has_exact_match(details['title'], details['issue_number'], details['year'])])
+
+    def lookup(item):
+        details, search_query = item
+        try:
+            report_inputs, prices, errors = gather_market_data(details, search_query, {})
+            return report_inputs, (price_summary(report_inputs, prices), errors)
+        except AppraisalError as e:
+            return None, (e.body, e.status)
+        except Exception as e:
+            logging.exception(f"Error looking up batch comic {search_query!r}")
+            return None, ({'error': str(e)}, 500)
+
+    market = dict(zip(comics, _map(lookup, comics.values())))
+    timings['lookups'] = round((time.perf_counter() - start) * 1000, 1)
+
+    reports = {}
+    if include_reports:
+        start = time.perf_counter()
+        priced = [key for key, (report_inputs, _) in market.items() if report_inputs]
+        texts = _map(lambda key: generate_qualitative_report(client=client, **market[key][0]), priced)
+        reports = dict(zip(priced, texts))
+        timings['report'] = round((time.perf_counter() - start) * 1000, 1)
+
+    books = []
+    totals = {'books': len(images), 'recognized': 0, 'priced': 0, 'uniqueComics': len(comics),
+              'ebayValue': 0.0, 'databaseValue': 0.0}
+    for (name, _), (details, search_query, failure) in zip(images, recognized):
+        book = {'filename': name}
+        books.append(book)
+        if not details:
+            body, status = failure
+            book.update(body, status=status)
+            continue
+
+        totals['recognized'] += 1
+        key = normalize_query(search_query)
+        book['comicDetails'] = comic_details_view(details)
+        report_inputs, outcome = market[key]
+        if not report_inputs:
+            body, status = outcome
+            book.update(body, status=status)
+            continue
+
+        prices, errors = outcome
+        book.update(status=200, prices=prices)
+        if errors:
+            book['errors'] = errors
+        if key in reports:
+            book['report'] = reports[key]
+        totals['priced'] += 1
+        totals['ebayValue'] += prices['averageEbayPrice']
+        totals['databaseValue'] += prices['databaseAveragePrice']
+
+    totals['ebayValue'] = round(totals['ebayValue'], 2)
+    totals['databaseValue'] = round(totals['databaseValue'], 2)
+    return {'books': books, 'totals': totals, 'timings': timings}
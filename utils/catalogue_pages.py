@@ -0,0 +1,175 @@
+"""
+Extract individual priced listings from dealer category pages.
+
+A 30th Century Comics category page lists many items in its `html` text, in two layouts:
+
+    AMAZING ADVENTURES (1970)          series heading, optionally "(Publisher YEAR)"
+    5 VF+ £33 Adams art                issue, grade, optional "p" (pence copy), price, notes
+    5 FN+ p £13.75 Adams art
+
+    THE ENDANGERED MAD                 title heading
+    Warner 1984 US PB                  publisher and year
+    GD £4                              grade and price
+
+Pages are scanned line by line with anchored, precompiled patterns and a small state
+machine, so extraction stays linear in the page size.
+"""
+import re
+from unidecode import unidecode
+
+GRADE_WORD = r"(?:PR|FA|GD|VG|FN|VF|NM|MT|M|Mint|New)[+-]?"
+GRADE = rf"{GRADE_WORD}(?:/{GRADE_WORD})?"
+# Reduced items read "was £5 now £2.50"; the current price is the one indexed
+PRICE = r"(?:was\s+£(?P<was_price>\d[\d,.]*)\s+now\s+)?£(?P<price>\d[\d,.]*)"
+
+LINE_PATTERN = re.compile(r"[^\n]+")
+# "5 FN+ p £13.75 Adams art", "62 App GD/VG £12", "8/1 VG was £5 now £2.50", "Vol 2 NM £30"
+ISSUE_LINE = re.compile(rf"^(?P<issue>\S.*?)(?:\s+App)?\s+(?P<grade>{GRADE})(?P<pence>\s+p)?\s+{PRICE}(?:\s+(?P<notes>.*))?$")
+# "GD £3", "VG/FN £8 with dust jacket"
+GRADE_LINE = re.compile(rf"^(?P<grade>{GRADE})(?P<pence>\s+p)?\s+{PRICE}(?:\s+(?P<notes>.*))?$")
+# Picture captions repeat an item: "BUNTY #3 VG+", "LION 1954 FN/VF", "ALARMING TALES #5 FA SOLD"
+CAPTION_LINE = re.compile(rf"^.+\s{GRADE}(?:\s+SOLD)?$")
+# "AVENGERS (1963)", "ASTONISHING (Atlas 1951)", "BEANO 1963", "THE IDES OF MAD",
+# "JOURNEY INTO MYSTERY (1952) (For 1950s issues, see Horror 1940-59 section)"
+HEADING_LINE = re.compile(r"^(?P<name>[A-Z0-9][A-Z0-9 &'’.,!?:/\-–]*?)(?:\s+\((?P<meta>[^)]*)\))?(?:\s+\([^)]*\))*(?:\s+(?P<year>(?:19|20)\d\d))?$")
+# The A-Z navigation bar and single-letter section markers are not headings
+HEADING_WORD = re.compile(r"[A-Z]{2}")
+# "Signet 1970 1st US PB", "Warner 1984 US PB"
+DETAIL_LINE = re.compile(r"^(?P<publisher>[A-Z][\w&'’. -]*?)(?:\s+(?P<year>(?:19|20)\d\d)\b.*)?$")
+YEAR_PATTERN = re.compile(r"\b(?:19|20)\d\d\b")
+ISSUE_NUMBER = re.compile(r"^(?:#|Vol\.?\s*|No\.?\s*)?(?P<number>\d+)$")
+
+# Parser states
+SCANNING, AFTER_HEADING, IN_BLOCK = range(3)
+
+def iter_lines(text):
+    """Yield the stripped, non-blank lines of a page without splitting it up front."""
+    for match in LINE_PATTERN.finditer(text):
+        line = match.group().replace('\xa0', ' ').strip()
+        if line:
+            yield line
+
+def parse_price(raw):
+    # Prices are written "£2,800" and occasionally mistyped "£4..50"
+    return float(re.sub(r'\.+', '.', raw.replace(',', '')).rstrip('.'))
+
+def parse_heading(match):
+    """Split a heading into (series, publisher, year) using its "(Publisher YEAR)" suffix."""
+    series = ' '.join(match.group('name').split())
+    publisher, year = '', match.group('year')
+    meta = match.group('meta')
+    if meta:
+        year_match = YEAR_PATTERN.search(meta)
+        if year_match:
+            year = year_match.group()
+            publisher = meta[:year_match.start()].strip()
+        elif meta[:1].isupper():
+            publisher = meta.strip()
+        else:
+            # "(2nd series)" and the like belong to the title
+            series = f"{series} ({meta.strip()})"
+    return series, publisher, int(year) if year else 0
+
+class ParseStats:
+    """
+    Parse coverage for one catalogue source: candidate items seen versus records extracted.
+
+    On category pages every line with a £ price is a candidate item; for sources with one
+    item per entry, every entry is.
+    """
+
+    def __init__(self):
+        self.entries = 0
+        self.candidates = 0
+        self.records = 0
+
+    @property
+    def coverage(self):
+        return self.records / self.candidates if self.candidates else 0.0
+
+def extract_listings(entry, stats=None):
+    """Yield one listing dict per priced item on a category page entry ({'title', 'url', 'html'})."""
+    url = entry.get('url', '')
+    series = publisher = ''
+    year = 0
+    seen_ids = {}
+    state = SCANNING
+    if stats:
+        stats.entries += 1
+
+    for line in iter_lines(entry.get('html', '')):
+        has_price = '£' in line
+        if has_price and stats:
+            stats.candidates += 1
+
+        if has_price:
+            match = GRADE_LINE.match(line)
+            if match and series and state == IN_BLOCK:
+                yield _listing(series, publisher, year, '', match, url, seen_ids, stats)
+                state = SCANNING
+                continue
+
+            match = ISSUE_LINE.match(line)
+            if match and series:
+                issue = match.group('issue')
+                listing_year = year
+                if not listing_year and YEAR_PATTERN.fullmatch(issue):
+                    # Annuals are listed by year rather than issue number
+                    listing_year = int(issue)
+                yield _listing(series, publisher, listing_year, issue, match, url, seen_ids, stats)
+                state = SCANNING
+            continue
+
+        if CAPTION_LINE.match(line):
+            continue
+
+        match = HEADING_LINE.match(line)
+        if match and HEADING_WORD.search(match.group('name')):
+            series, publisher, year = parse_heading(match)
+            state = AFTER_HEADING
+            continue
+
+        if state == AFTER_HEADING:
+            match = DETAIL_LINE.match(line)
+            if match:
+                publisher = publisher or match.group('publisher').strip()
+                year = year or int(match.group('year') or 0)
+                state = IN_BLOCK
+                continue
+        # Notes, stock codes and page furniture don't change the current heading
+
+def _listing(series, publisher, year, issue, match, url, seen_ids, stats):
+    grade = match.group('grade')
+    number_match = ISSUE_NUMBER.match(issue)
+    issue_number = int(number_match.group('number')) if number_match else 0
+    key = unidecode(f"{url}#{series}_{issue}_{year}_{grade}")
+    # Identical lines (the same issue and grade listed twice) still get distinct IDs
+    seen_ids[key] = seen_ids.get(key, 0) + 1
+    if stats:
+        stats.records += 1
+
+    full_title = series
+    if publisher or year:
+        full_title += f" ({' '.join(str(part) for part in (publisher, year or '') if part)})"
+    if issue:
+        full_title += f" #{issue}"
+    full_title += f" {grade}"
+
+    listing = {
+        "title": series,
+        "series": series,
+        "year": year,
+        "publisher": publisher,
+        "volume": 1,
+        "issue_number": issue_number,
+        "condition": grade,
+        "pence_copy": bool(match.group('pence')),
+        "price": parse_price(match.group('price')),
+        "notes": (match.group('notes') or '').strip(),
+        "url": url,
+        "full_title": full_title,
+        "listing_id": f"{key}_{seen_ids[key]}",
+    }
+    if match.group('was_price'):
+        listing["was_price"] = parse_price(match.group('was_price'))
+    return listing
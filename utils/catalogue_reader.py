@@ -0,0 +1,126 @@
+"""
+Stream catalogue entries out of scraped dumps without loading whole files.
+
+Accepts JSON files holding a top-level array of entries, JSON Lines files with one entry per
+line, and gzip-compressed versions of either (.json, .jsonl, .json.gz, .jsonl.gz). JSON
+arrays are parsed with ijson when it is installed and with an incremental decoder over
+fixed-size chunks otherwise; either way memory is bounded by the largest single entry.
+"""
+import gzip
+import io
+import json
+import logging
+import os
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+CATALOGUE_EXTENSIONS = ('.json', '.jsonl', '.json.gz', '.jsonl.gz')
+CHUNK_SIZE = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+
+def find_catalogue_files(paths):
+    """Expand files and directories (searched recursively) into a sorted list of catalogue files."""
+    if isinstance(paths, str):
+        paths = [paths]
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                found.extend(os.path.join(root, name) for name in names if name.endswith(CATALOGUE_EXTENSIONS))
+        elif path.endswith(CATALOGUE_EXTENSIONS):
+            found.append(path)
+        else:
+            logging.warning(f"Skipping {path}: not a catalogue file")
+    return sorted(found)
+
+def _iter_json_lines(text_file, path):
+    for line_number, line in enumerate(text_file, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            logging.error(f"Skipping malformed line {line_number} in {path}: {e}")
+
+def _iter_json_array(text_file):
+    """Decode the elements of a top-level JSON array one at a time from a text stream."""
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+
+    while True:
+        # Skip whitespace and separators between elements
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if not started and position < len(buffer):
+            if buffer[position] != '[':
+                raise ValueError("Expected a JSON array of entries")
+            started = True
+            position += 1
+            continue
+        if started and position < len(buffer) and buffer[position] == ']':
+            return
+
+        if position < len(buffer):
+            try:
+                entry, end = _decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                # A number at the very end of the buffer may still be cut off
+                if end < len(buffer) or eof:
+                    yield entry
+                    position = end
+                    continue
+        elif eof:
+            if started:
+                raise ValueError("Unterminated JSON array")
+            return
+
+        chunk = text_file.read(CHUNK_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+def iter_catalogue_file(path, progress=None):
+    """
+    Yield the entries of one catalogue file.
+
+    `progress`, if given, is called with the number of bytes of the file on disk (compressed,
+    for .gz files) consumed since the previous call.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as raw:
+        last_position = 0
+
+        def report(finished=False):
+            nonlocal last_position
+            if progress:
+                # The text wrapper closes the file when it is collected, so finish from the size
+                position = size if finished or raw.closed else raw.tell()
+                progress(position - last_position)
+                last_position = position
+
+        stream = gzip.GzipFile(fileobj=raw, mode='rb') if path.endswith('.gz') else raw
+        name = path[:-3] if path.endswith('.gz') else path
+        try:
+            if name.endswith('.jsonl'):
+                entries = _iter_json_lines(io.TextIOWrapper(stream, encoding='utf-8'), path)
+            elif ijson is not None:
+                entries = ijson.items(stream, 'item', use_float=True)
+            else:
+                entries = _iter_json_array(io.TextIOWrapper(stream, encoding='utf-8'))
+            for entry in entries:
+                yield entry
+                report()
+        except Exception as e:
+            logging.error(f"Error reading catalogue file {path}: {e}")
+        finally:
+            report(finished=True)
@@ -0,0 +1,251 @@
+"""
+Columnar copy of the parsed catalogue for exact lookups and price statistics.
+
+Each record is one row of a NumPy structured array saved as rows.npy and memory-mapped on
+load. Text fields are stored as integer codes into per-column string tables (strings.json),
+so a row is a few dozen bytes. Rows are sorted by a 64-bit key packing the code of the
+normalized series with the issue number, so every listing of an issue, across all dealers,
+is one contiguous slice found with a binary search. Like LocalIndex, each save writes a new
+generation (see utils.generations).
+"""
+import json
+import logging
+import os
+import numpy as np
+from config import CATALOGUE_STORE_PATH
+from utils.generations import new_generation, publish_generation
+
+# Text columns held as codes into string tables
+STRING_COLUMNS = ('normalized_series', 'series', 'publisher', 'condition', 'source', 'url')
+
+ROW_DTYPE = np.dtype([
+    ('key', 'i8'),
+    ('normalized_series', 'i4'),
+    ('series', 'i4'),
+    ('publisher', 'i4'),
+    ('condition', 'i4'),
+    ('source', 'i4'),
+    ('url', 'i4'),
+    ('issue_number', 'i4'),
+    ('year', 'i2'),
+    ('volume', 'i2'),
+    ('price', 'f4'),
+])
+
+CHUNK_ROWS = 65536
+PERCENTILES = (10, 25, 50, 75, 90)
+
+def issue_key(issue_number):
+    """
+    The integer issue used in the key, or None for issues the store cannot match ("1/2", "8.5").
+
+    Listings whose issue could not be parsed are recorded as issue 0, so 0 never matches.
+    """
+    try:
+        number = float(str(issue_number).strip())
+    except ValueError:
+        return None
+    if not number.is_integer() or not 0 < number < 2 ** 31:
+        return None
+    return int(number)
+
+def year_key(year):
+    """The publication year as an int, or None when it is missing or not a plausible year."""
+    try:
+        year = int(str(year).strip()[:4])
+    except ValueError:
+        return None
+    return year if 1800 <= year <= 2100 else None
+
+def _pack(series_code, issue):
+    return (np.int64(series_code) << 32) | np.int64(issue)
+
+class CatalogueStoreWriter:
+    """
+    Collect parsed catalogue records and write them out as a new store generation.
+
+    Records sharing an ID resolve to the last one seen, matching upsert semantics. Rows are
+    filled into fixed-size chunks rather than kept as dicts, so memory stays small for large
+    catalogues.
+    """
+
+    def __init__(self, path=CATALOGUE_STORE_PATH):
+        self.path = path
+        self._strings = {column: {} for column in STRING_COLUMNS}
+        self._chunks = []
+        self._ids = []
+        self._rows_by_id = {}
+
+    def _code(self, column, value):
+        table = self._strings[column]
+        value = str(value or '')
+        code = table.get(value)
+        if code is None:
+            code = table[value] = len(table)
+        return code
+
+    def _row(self, position):
+        chunk, offset = divmod(position, CHUNK_ROWS)
+        if chunk == len(self._chunks):
+            self._chunks.append(np.zeros(CHUNK_ROWS, dtype=ROW_DTYPE))
+        return self._chunks[chunk], offset
+
+    def add(self, comic_id, record, source=''):
+        issue = issue_key(record.get('issue_number', ''))
+        position = self._rows_by_id.get(comic_id)
+        if position is None:
+            position = self._rows_by_id[comic_id] = len(self._ids)
+            self._ids.append(comic_id)
+        chunk, offset = self._row(position)
+
+        row = chunk[offset]
+        for column in STRING_COLUMNS:
+            value = source if column == 'source' else record.get(column, '')
+            row[column] = self._code(column, value)
+        # Issues without an integer number are kept for statistics but never match a lookup
+        row['issue_number'] = int(record.get('issue_number') or 0) if issue is None else issue
+        row['key'] = -1 if issue is None else _pack(row['normalized_series'], issue)
+        row['year'] = int(record.get('year') or 0)
+        row['volume'] = int(record.get('volume') or 0)
+        row['price'] = float(record.get('price') or 0.0)
+
+    def track(self, entries, make_id, source_of=lambda record: ''):
+        """Pass entries through while adding each to the store."""
+        for record in entries:
+            self.add(make_id(record), record, source_of(record))
+            yield record
+
+    def write(self):
+        """Sort the rows by key and write them as a new, not yet current, generation. Returns its directory."""
+        count = len(self._ids)
+        rows = np.concatenate(self._chunks)[:count] if self._chunks else np.zeros(0, dtype=ROW_DTYPE)
+        order = np.argsort(rows['key'], kind='stable')
+
+        generation = new_generation(self.path)
+        np.save(os.path.join(generation, 'rows.npy'), rows[order])
+        with open(os.path.join(generation, 'strings.json'), 'w', encoding='utf-8') as f:
+            json.dump({column: list(table) for column, table in self._strings.items()}, f)
+        with open(os.path.join(generation, 'ids.json'), 'w', encoding='utf-8') as f:
+            json.dump([self._ids[i] for i in order], f)
+        logging.info(f"Wrote catalogue store with {count} rows to {generation}")
+        return generation
+
+    def publish(self, generation):
+        publish_generation(self.path, generation)
+
+    def save(self):
+        """Write a new generation and make it current. Returns the number of rows."""
+        self.publish(self.write())
+        return len(self._ids)
+
+class CatalogueStore:
+    """
+    Read side of one store generation: exact (normalized series, issue) lookups over the
+    memory-mapped rows. Serving code gets the current generation from
+    utils.resources.get_catalogue_store, which follows new builds.
+    """
+
+    def __init__(self, generation):
+        if generation is None:
+            logging.warning("No catalogue store generation has been published")
+            self.rows = np.zeros(0, dtype=ROW_DTYPE)
+            self.strings = {column: [] for column in STRING_COLUMNS}
+            self.ids = []
+        else:
+            self.rows = np.load(os.path.join(generation, 'rows.npy'), mmap_mode='r')
+            with open(os.path.join(generation, 'strings.json'), 'r', encoding='utf-8') as f:
+                self.strings = json.load(f)
+            with open(os.path.join(generation, 'ids.json'), 'r', encoding='utf-8') as f:
+                self.ids = json.load(f)
+            logging.info(f"Loaded catalogue store with {len(self.rows)} rows from {generation}")
+        self._series_codes = {name: code for code, name in enumerate(self.strings['normalized_series'])}
+        # The key column is what every lookup searches, so keep it in memory
+        self._keys = np.ascontiguousarray(self.rows['key'])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def lookup(self, normalized_series, issue_number):
+        """Return the slice of rows (possibly empty) for a normalized series and issue."""
+        code = self._series_codes.get(normalized_series)
+        issue = issue_key(issue_number)
+        if code is None or issue is None:
+            return slice(0, 0)
+        key = _pack(code, issue)
+        start = int(np.searchsorted(self._keys, key, side='left'))
+        end = int(np.searchsorted(self._keys, key, side='right'))
+        return slice(start, end)
+
+    def select(self, normalized_series, issue_number, year=None):
+        """
+        Row positions for one printing of an issue, or an empty array when it cannot be told apart.
+
+        A series and issue can cover several volumes published in different years. With a
+        known `year`, only rows from that year are kept (rows without a year are kept only if
+        no row has one). Without a year, the rows are returned only if they do not span more
+        than one year.
+        """
+        rows = self.lookup(normalized_series, issue_number)
+        positions = np.arange(rows.start, rows.stop)
+        years = np.asarray(self.rows['year'][rows])
+        known = years > 0
+        if not known.any():
+            return positions
+        year = year_key(year)
+        if year is not None:
+            return positions[years == year]
+        if len(np.unique(years[known])) > 1:
+            return positions[:0]
+        return positions
+
+    def records(self, rows):
+        """Expand a slice or array of row positions into metadata dicts shaped like the vector index metadata."""
+        records = []
+        positions = range(*rows.indices(len(self.rows))) if isinstance(rows, slice) else rows
+        for position in positions:
+            position = int(position)
+            row = self.rows[position]
+            record = {column: self.strings[column][row[column]] for column in STRING_COLUMNS}
+            record.update(
+                id=self.ids[position],
+                title=record['series'],
+                issue_number=int(row['issue_number']),
+                year=int(row['year']),
+                volume=int(row['volume']),
+                price=float(row['price']),
+            )
+            records.append(record)
+        return records
+
+    def price_distribution(self, normalized_series, issue_number, year=None, by=None):
+        """
+        Summarize the prices of every stored copy of one printing of an issue.
+
+        The printing is chosen by `year` as in select(). Returns None when the store has no
+        such printing. `by` may name a text column such as 'condition' or 'source' to add the
+        same summary per value of that column.
+        """
+        rows = self.rows[self.select(normalized_series, issue_number, year)]
+        prices = rows['price']
+        priced = prices > 0
+        if not priced.any():
+            return None
+        distribution = _summarize(prices[priced])
+        if by:
+            codes = rows[by][priced]
+            distribution[f"by_{by}"] = {
+                self.strings[by][code]: _summarize(prices[priced][codes == code]) for code in np.unique(codes)
+            }
+        return distribution
+
+def _summarize(prices):
+    prices = prices.astype(np.float64)
+    summary = {
+        'count': int(len(prices)),
+        'min': round(float(prices.min()), 2),
+        'max': round(float(prices.max()), 2),
+        'mean': round(float(prices.mean()), 2),
+    }
+    for percentile, value in zip(PERCENTILES, np.percentile(prices, PERCENTILES)):
+        summary[f"p{percentile}"] = round(float(value), 2)
+    return summary
@@ -1,20 +1,128 @@
-import requests
+import json
 import logging
+import threading
+import time
+import redis
+import requests
+from config import EXCHANGE_RATE_TTL
+from utils.resources import get_redis
+from utils import http_client
+from utils.metrics import span, UPSTREAM_ERRORS
 
-def convert_currency(amount, from_currency, to_currency='GBP'):
+# Process-wide rate tables keyed by base currency: {base: (fetched_at, rates)}
+_rate_tables = {}
+_rate_lock = threading.Lock()
+_refreshing = set()
+
+def _redis_key(base_currency):
+    return f"fx:rates:{base_currency}"
+
+def _fetch_rate_table(base_currency):
+    """Fetch a fresh rate table from the API and publish it to the shared cache."""
+    try:
+        response = http_client.get(f'https://api.exchangerate-api.com/v4/latest/{base_currency}')
+        response.raise_for_status()
+    except requests.exceptions.RequestException:
+        UPSTREAM_ERRORS.labels('exchange_rates').inc()
+        raise
+    rates = response.json().get('rates', {})
+    fetched_at = time.time()
+    with _rate_lock:
+        _rate_tables[base_currency] = (fetched_at, rates)
+    try:
+        # Keep the shared copy well past the TTL so other workers can still fall back to it offline
+        get_redis().set(_redis_key(base_currency), json.dumps({'fetched_at': fetched_at, 'rates': rates}), ex=EXCHANGE_RATE_TTL * 24)
+    except redis.exceptions.RedisError as e:
+        logging.warning(f"Unable to store exchange rates for {base_currency} in Redis: {e}")
+    return fetched_at, rates
+
+def _load_shared_rate_table(base_currency):
+    """Load a rate table another worker has already fetched."""
+    try:
+        cached = get_redis().get(_redis_key(base_currency))
+    except redis.exceptions.RedisError as e:
+        logging.warning(f"Unable to read exchange rates for {base_currency} from Redis: {e}")
+        return None
+    if not cached:
+        return None
+    table = json.loads(cached)
+    entry = (table['fetched_at'], table['rates'])
+    with _rate_lock:
+        current = _rate_tables.get(base_currency)
+        if not current or current[0] < entry[0]:
+            _rate_tables[base_currency] = entry
+    return entry
+
+def _refresh_in_background(base_currency):
+    with _rate_lock:
+        if base_currency in _refreshing:
+            return
+        _refreshing.add(base_currency)
+
+    def refresh():
+        try:
+            _fetch_rate_table(base_currency)
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"Background refresh of exchange rates for {base_currency} failed: {e}")
+        finally:
+            with _rate_lock:
+                _refreshing.discard(base_currency)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+def get_rate_table(base_currency):
     """
-    Convert an amount from one currency to another using an external API.
+    Return the rate table for a base currency.
+
+    Tables are served from the process cache, then Redis, then the API. A stale table is
+    returned immediately while a background refresh runs, and the last-known table is used
+    when the API is unreachable.
     """
-    logging.info(f"Converting currency from {from_currency} to {to_currency}...")
+    entry = _rate_tables.get(base_currency)
+    if not entry or time.time() - entry[0] > EXCHANGE_RATE_TTL:
+        entry = _load_shared_rate_table(base_currency) or entry
+
+    if entry and time.time() - entry[0] <= EXCHANGE_RATE_TTL:
+        return entry[1]
+    if entry:
+        _refresh_in_background(base_currency)
+        return entry[1]
+
     try:
-        response = requests.get(f'https://api.exchangerate-api.com/v4/latest/{from_currency}')
-        response.raise_for_status()
-        rates = response.json().get('rates', {})
-        if to_currency in rates:
-            return amount * rates[to_currency]
-        else:
-            logging.error(f"Currency not found: {to_currency}")
-            return amount
+        return _fetch_rate_table(base_currency)[1]
     except requests.exceptions.RequestException as e:
         logging.exception(f"Error fetching exchange rates: {e}")
-        return amount
\ No newline at end of file
+        return {}
+
+def convert_currency(amount, from_currency, to_currency='GBP'):
+    """
+    Convert an amount from one currency to another using cached exchange rates.
+    """
+    logging.info(f"Converting currency from {from_currency} to {to_currency}...")
+    if from_currency == to_currency:
+        return amount
+    rates = get_rate_table(from_currency)
+    if to_currency in rates:
+        return amount * rates[to_currency]
+    else:
+        logging.error(f"Currency not found: {to_currency}")
+        return amount
+
+def convert_many(amounts, currencies, to_currency='GBP'):
+    """
+    Convert a list of amounts, each in its own currency, to a single target currency.
+
+    Uses one rate table based on the target currency, so the whole list costs at most one lookup.
+    """
+    with span('currency_conversion'):
+        rates = get_rate_table(to_currency)
+        converted = []
+        for amount, from_currency in zip(amounts, currencies):
+            if from_currency == to_currency:
+                converted.append(amount)
+            elif rates.get(from_currency):
+                converted.append(amount / rates[from_currency])
+            else:
+                logging.error(f"Currency not found: {from_currency}")
+                converted.append(amount)
+    return converted
@@ -1,9 +1,14 @@
 import logging
-from sentence_transformers import SentenceTransformer
-from pinecone import Pinecone
+import threading
+from utils.resources import get_model, get_vector_index, get_catalogue_store
+from utils.embedding_cache import EmbeddingCache
+from utils.metrics import span, CACHE_EVENTS
+from config import (EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_DISK_ENTRIES, DATABASE_TOP_K,
+                    DATABASE_EXACT_MATCH)
 import os
 from dotenv import load_dotenv
-from fuzzywuzzy import fuzz
+import numpy as np
+from rapidfuzz import fuzz, process
 from jellyfish import soundex
 import re
 
@@ -14,13 +19,6 @@ logging.basicConfig(level=logging.DEBUG,
 # Load environment variables
 load_dotenv()
 
-# Initialize Pinecone
-pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
-index = pc.Index(os.getenv('PINECONE_INDEX_NAME'))
-
-# Load the pre-trained model
-model = SentenceTransformer('all-MiniLM-L6-v2')
-
 def preprocess_title(title):
     """Preprocess the title to improve matching."""
     # Convert to lowercase
@@ -33,23 +31,57 @@ def preprocess_title(title):
     title = re.sub(r'[^\w\s]', '', title)
     return title
 
-def calculate_title_similarity(stored_title, search_title):
-    """Calculate the similarity between two titles using multiple methods."""
-    stored_title = preprocess_title(stored_title)
-    search_title = preprocess_title(search_title)
-    
-    ratio = fuzz.ratio(stored_title, search_title)
-    partial_ratio = fuzz.partial_ratio(stored_title, search_title)
-    token_sort_ratio = fuzz.token_sort_ratio(stored_title, search_title)
-    token_set_ratio = fuzz.token_set_ratio(stored_title, search_title)
-    
-    soundex_match = 100 if soundex(stored_title) == soundex(search_title) else 0
-    
-    # Weighted average of different similarity measures
-    similarity = (ratio * 0.3 + partial_ratio * 0.2 + token_sort_ratio * 0.2 + 
-                  token_set_ratio * 0.2 + soundex_match * 0.1)
-    
-    return similarity
+# Query embeddings keyed by title, so repeat lookups skip the encode
+embedding_cache = EmbeddingCache(lambda text: get_model().encode(text), max_entries=EMBEDDING_CACHE_SIZE,
+                                 disk_path=EMBEDDING_CACHE_PATH or None, disk_entries=EMBEDDING_CACHE_DISK_ENTRIES,
+                                 encode_many=lambda texts: get_model().encode(texts))
+
+def warm_embeddings(titles):
+    """Encode the query embeddings for many titles in one model call, ahead of their lookups."""
+    with span('embedding'):
+        embedding_cache.encode_many(titles)
+
+def get_embedding_cache_stats():
+    return embedding_cache.stats()
+
+def title_features(series):
+    """Precomputed matching features for a stored series title, kept in vector metadata."""
+    normalized = preprocess_title(series)
+    return {'normalized_series': normalized, 'series_soundex': soundex(normalized) if normalized else ''}
+
+def rerank_matches(matches, title, issue_number):
+    """
+    Score vector matches against the search title and issue in one batch.
+
+    The search title is preprocessed once, stored titles use the features precomputed at
+    ingest (computed here only for older entries without them), and the four fuzzy ratios
+    are evaluated for all candidates at once with rapidfuzz's cdist.
+    Returns the matches as [{'metadata', 'score'}] sorted by score, best first.
+    """
+    if not matches:
+        return []
+    search_title = preprocess_title(title)
+    search_soundex = soundex(search_title) if search_title else ''
+
+    metadatas = [match['metadata'] for match in matches]
+    features = [
+        metadata if 'normalized_series' in metadata else title_features(metadata.get('series', ''))
+        for metadata in metadatas
+    ]
+    stored_titles = [feature['normalized_series'] for feature in features]
+
+    similarity = np.zeros(len(matches))
+    for scorer, weight in ((fuzz.ratio, 0.3), (fuzz.partial_ratio, 0.2),
+                           (fuzz.token_sort_ratio, 0.2), (fuzz.token_set_ratio, 0.2)):
+        similarity += weight * process.cdist([search_title], stored_titles, scorer=scorer)[0]
+    soundex_match = np.array([feature['series_soundex'] == search_soundex for feature in features])
+    similarity += 10.0 * soundex_match
+
+    issue_match = np.array([compare_issue_numbers(metadata.get('issue_number', ''), issue_number) for metadata in metadatas])
+    scores = similarity + 50.0 * issue_match
+
+    order = np.argsort(-scores, kind='stable')
+    return [{'metadata': metadatas[i], 'score': float(scores[i])} for i in order]
 
 def compare_issue_numbers(stored_issue, search_issue):
     """Compare issue numbers, handling various formats."""
@@ -61,38 +93,63 @@ def compare_issue_numbers(stored_issue, search_issue):
         # If conversion to float fails, do a string comparison
         return str(stored_issue).strip() == str(search_issue).strip()
 
-def fetch_database_info(title, issue_number):
-    """Fetch both prices and metadata for a given comic book."""
-    query_vector = model.encode(f"{title}").tolist()
-    result = index.query(vector=query_vector, top_k=20, include_metadata=True)
-    
-    logging.info(f"Query result for '{title}' issue '{issue_number}': {result}")
-    
-    matches = []
-    for match in result['matches']:
-        metadata = match['metadata']
-        stored_title = metadata.get('series', '')
-        stored_issue = metadata.get('issue_number', '')
-        
-        # Calculate title similarity
-        title_similarity = calculate_title_similarity(stored_title, title)
-        
-        # Check issue number match
-        issue_match = compare_issue_numbers(stored_issue, issue_number)
-        
-        # Calculate overall score
-        overall_score = title_similarity + (50 if issue_match else 0)
-        
-        matches.append({
-            'metadata': metadata,
-            'score': overall_score
-        })
-    
-    # Sort matches by score in descending order
-    matches.sort(key=lambda x: x['score'], reverse=True)
+# Matches returned per catalogue lookup
+DATABASE_MATCHES = 5
+
+exact_match_stats = {'lookups': 0, 'hits': 0}
+_exact_match_lock = threading.Lock()
+
+def get_exact_match_stats():
+    """Return exact-match lookup counts and the share answered without a vector query."""
+    with _exact_match_lock:
+        lookups = exact_match_stats['lookups']
+        return dict(exact_match_stats, hit_rate=exact_match_stats['hits'] / lookups if lookups else 0.0)
+
+def exact_matches(title, issue_number, year=None):
+    """
+    Every catalogue record of this printing, by exact normalized series, issue and year.
+
+    Returns [] when the store has no such issue or cannot tell which year's printing is meant.
+    """
+    store = get_catalogue_store()
+    return store.records(store.select(preprocess_title(title), issue_number, year))
+
+def has_exact_match(title, issue_number, year=None):
+    return DATABASE_EXACT_MATCH and bool(exact_matches(title, issue_number, year))
+
+def fetch_database_info(title, issue_number, year=None):
+    """
+    Fetch both prices and metadata for a given comic book.
+
+    A title, issue and year found verbatim (after normalization) in the catalogue store are
+    answered from its exact index with every stored copy of that printing; anything else
+    falls back to embedding the title, a vector query and a fuzzy rerank.
+    """
+    if DATABASE_EXACT_MATCH:
+        with span('exact_match'):
+            matches = exact_matches(title, issue_number, year)
+        with _exact_match_lock:
+            exact_match_stats['lookups'] += 1
+            exact_match_stats['hits'] += bool(matches)
+        if matches:
+            CACHE_EVENTS.labels('exact_match', 'hit').inc()
+            logging.info(f"Exact match for '{title}' issue '{issue_number}' ({year}): {len(matches)} catalogue entries")
+            prices = [match['price'] for match in matches if match['price']]
+            return prices, matches
+        CACHE_EVENTS.labels('exact_match', 'miss').inc()
+
+    with span('embedding'):
+        query_vector = embedding_cache.encode(f"{title}").tolist()
+    with span('vector_query'):
+        result = get_vector_index().query(vector=query_vector, top_k=DATABASE_TOP_K, include_metadata=True)
     
+    logging.info(f"Query for '{title}' issue '{issue_number}' returned {len(result['matches'])} matches")
+
+    with span('rerank'):
+        matches = rerank_matches(result['matches'], title, issue_number)
+
     # Return the top 5 matches
-    top_matches = matches[:5]
+    top_matches = matches[:DATABASE_MATCHES]
     
     prices = [float(match['metadata'].get('price', 0)) for match in top_matches if match['metadata'].get('price')]
     metadata = [match['metadata'] for match in top_matches]
@@ -102,11 +159,21 @@ def fetch_database_info(title, issue_number):
     
     return prices, metadata
 
+def fetch_price_distribution(title, issue_number, year=None, by='condition'):
+    """
+    Price distribution over every catalogue copy of a printing, from the columnar store.
+
+    Selects rows by exact normalized series, issue and year like exact_matches, so no
+    embedding or vector query is needed. Returns None if the store has no such printing.
+    """
+    with span('price_distribution'):
+        return get_catalogue_store().price_distribution(preprocess_title(title), issue_number, year, by=by)
+
 def search_comics(query, top_k=5):
     logging.info(f"Searching for comics with query: {query}")
-    query_vector = model.encode(query).tolist()
+    query_vector = embedding_cache.encode(query).tolist()
     
-    result = index.query(
+    result = get_vector_index().query(
         vector=query_vector,
         top_k=top_k,
         include_metadata=True
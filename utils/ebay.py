@@ -1,10 +1,18 @@
 import os
+import re
 import json
+import time
+import threading
 import requests
 import logging
+from concurrent.futures import Future
 from dotenv import load_dotenv
 import redis
+from utils.resources import get_redis
+from utils import http_client
+from utils.metrics import span, UPSTREAM_ERRORS, CACHE_EVENTS
 from datetime import datetime, timedelta
+from config import EBAY_CACHE_TTL, EBAY_CACHE_STALE_TTL
 
 load_dotenv()
 
@@ -12,7 +20,14 @@ CLIENT_ID = os.getenv('CLIENT_ID')
 CLIENT_SECRET = os.getenv('CLIENT_SECRET')
 REDIRECT_URI = os.getenv('REDIRECT_URI', 'http://localhost:8000/callback')
 
-cache = redis.Redis(host='localhost', port=6379, db=0)
+EBAY_CACHE_NAMESPACE = 'ebay:search:v1:'
+
+cache_stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'coalesced': 0}
+_stats_lock = threading.Lock()
+
+# Upstream calls currently in flight, keyed by cache key
+_inflight = {}
+_inflight_lock = threading.Lock()
 
 def get_ebay_oauth_token():
     logging.info("Fetching eBay OAuth token...")
@@ -23,44 +38,138 @@ def get_ebay_oauth_token():
             'grant_type': 'client_credentials',
             'scope': 'https://api.ebay.com/oauth/api_scope'
         }
-        response = requests.post(token_url, headers=headers, data=data, auth=(CLIENT_ID, CLIENT_SECRET))
+        # A client-credentials grant only issues a token, so it is safe to repeat
+        response = http_client.post(token_url, headers=headers, data=data, auth=(CLIENT_ID, CLIENT_SECRET),
+                                    idempotent=True)
         response.raise_for_status()
         token = response.json().get('access_token')
-        cache.set('EBAY_OAUTH_TOKEN', token, ex=3600)
+        get_redis().set('EBAY_OAUTH_TOKEN', token, ex=3600)
         return token
     except requests.exceptions.RequestException as e:
+        UPSTREAM_ERRORS.labels('ebay_oauth').inc()
         logging.exception(f"Error fetching eBay OAuth token: {e}")
         return None
 
+def normalize_query(query):
+    """Normalize a search query so trivially different spellings share a cache entry."""
+    query = query.lower()
+    query = re.sub(r'[^\w\s#]', ' ', query)
+    return ' '.join(query.split())
+
+def _cache_key(query):
+    return f"{EBAY_CACHE_NAMESPACE}{normalize_query(query)}"
+
+# cache_stats keys and their CACHE_EVENTS results
+_CACHE_RESULTS = {'hits': 'hit', 'stale_hits': 'stale_hit', 'misses': 'miss', 'coalesced': 'coalesced'}
+
+def _count(stat):
+    with _stats_lock:
+        cache_stats[stat] += 1
+    CACHE_EVENTS.labels('ebay', _CACHE_RESULTS[stat]).inc()
+
+def get_cache_stats():
+    with _stats_lock:
+        return dict(cache_stats)
+
+def _search_ebay(query):
+    token = get_redis().get('EBAY_OAUTH_TOKEN')
+    if token:
+        token = token.decode('utf-8')
+    else:
+        token = get_ebay_oauth_token()
+    if not token:
+        return {}
+
+    url = 'https://api.ebay.com/buy/browse/v1/item_summary/search'
+    headers = {
+        'Authorization': f'Bearer {token}',
+        'Content-Type': 'application/json'
+    }
+    params = {
+        'q': query,
+        'category_ids': '158671',
+        'filter': 'price:[10..],priceCurrency:GBP',
+        'item_location_country': 'GB',
+        'item_condition': '3000',
+        'buying_options': 'FIXED_PRICE',
+        'sold_items_only': 'true'
+    }
+
+    response = http_client.get(url, headers=headers, params=params)
+    response.raise_for_status()
+    return response.json()
+
+def _refresh(query, key):
+    """Fetch a query from eBay and store it, sharing the call with concurrent identical queries."""
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+
+    if not leader:
+        _count('coalesced')
+        return future.result()
+
+    try:
+        with span('ebay_fetch'):
+            data = _search_ebay(query)
+        if data:
+            entry = {'fetched_at': time.time(), 'data': data}
+            try:
+                get_redis().set(key, json.dumps(entry), ex=EBAY_CACHE_TTL + EBAY_CACHE_STALE_TTL)
+            except redis.exceptions.RedisError as e:
+                logging.warning(f"Unable to cache eBay data for query: {query} - {e}")
+        future.set_result(data)
+        return data
+    except Exception as e:
+        UPSTREAM_ERRORS.labels('ebay').inc()
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+def _refresh_in_background(query, key):
+    def refresh():
+        try:
+            _refresh(query, key)
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"Background refresh of eBay data failed for query: {query} - {e}")
+
+    with _inflight_lock:
+        if key in _inflight:
+            return
+    threading.Thread(target=refresh, daemon=True).start()
+
 def fetch_ebay_data(query):
+    """
+    Fetch eBay sold listings for a query through the Redis read-through cache.
+
+    Entries younger than EBAY_CACHE_TTL are served directly. Older entries are served
+    stale for up to EBAY_CACHE_STALE_TTL more seconds while a background refresh runs.
+    """
     logging.info(f"Fetching eBay data for query: {query}")
+    key = _cache_key(query)
     try:
-        token = cache.get('EBAY_OAUTH_TOKEN')
-        if not token:
-            token = get_ebay_oauth_token()
-        if not token:
-            return {}
-
-        url = 'https://api.ebay.com/buy/browse/v1/item_summary/search'
-        headers = {
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json'
-        }
-        params = {
-            'q': query,
-            'category_ids': '158671',
-            'filter': 'price:[10..],priceCurrency:GBP',
-            'item_location_country': 'GB',
-            'item_condition': '3000',
-            'buying_options': 'FIXED_PRICE',
-            'sold_items_only': 'true'
-        }
+        cached = get_redis().get(key)
+    except redis.exceptions.RedisError as e:
+        logging.warning(f"Unable to read eBay cache for query: {query} - {e}")
+        cached = None
 
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        data = response.json()
-        cache.set(query, json.dumps(data), ex=3600)
-        return data
+    if cached:
+        entry = json.loads(cached)
+        if time.time() - entry.get('fetched_at', 0) <= EBAY_CACHE_TTL:
+            _count('hits')
+        else:
+            _count('stale_hits')
+            _refresh_in_background(query, key)
+        return entry.get('data', {})
+
+    _count('misses')
+    try:
+        return _refresh(query, key)
     except requests.exceptions.RequestException as e:
         logging.exception(f"Error fetching eBay data for query: {query} - {e}")
         return {}
@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+import numpy as np
+from utils.metrics import CACHE_EVENTS
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of query embeddings keyed by the exact text that was embedded.
+
+    When `disk_path` is set, embeddings are also written to a memory-mapped table of
+    `disk_entries` rows (`<disk_path>.rows`) shared by every process that opens it, so the
+    cache survives restarts and is warm for all gunicorn workers. A text always lives in the
+    row its hash picks, and each row carries the hash of its key and a CRC of its vector, so
+    there is no key map to keep in sync: a lookup only trusts a row whose key hash and CRC both
+    match, which also turns a row torn by two workers writing at once into a miss.
+    """
+
+    def __init__(self, encode, max_entries=1024, disk_path=None, disk_entries=65536, dimension=384,
+                 encode_many=None):
+        self._encode = encode
+        self._encode_many = encode_many
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._disk = None
+        self.disk_path = disk_path
+        if disk_path:
+            try:
+                self._open_disk(disk_entries, dimension)
+            except (OSError, ValueError) as e:
+                logging.error(f"Embedding cache {disk_path}.rows unavailable, using memory only: {e}")
+                self._disk = None
+
+    def _open_disk(self, disk_entries, dimension):
+        dtype = np.dtype([('key', 'S16'), ('check', '<u4'), ('vector', '<f4', (dimension,))])
+        path = f"{self.disk_path}.rows"
+        size = disk_entries * dtype.itemsize
+        # Exclusive create so a worker never truncates a table another worker has mapped
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            pass
+        else:
+            try:
+                os.ftruncate(fd, size)
+            finally:
+                os.close(fd)
+        if os.path.getsize(path) != size:
+            raise ValueError(f"expected {size} bytes for {disk_entries} rows of dimension {dimension}")
+        self._disk = np.memmap(path, dtype=dtype, mode='r+', shape=(disk_entries,))
+
+    def _disk_slot(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little') % len(self._disk), digest
+
+    def _load_from_disk(self, key):
+        row, digest = self._disk_slot(key)
+        entry = self._disk[row]
+        if bytes(entry['key']) != digest.rstrip(b'\0'):
+            return None
+        vector = np.array(entry['vector'])
+        if zlib.crc32(vector.tobytes()) != int(entry['check']):
+            return None
+        return vector
+
+    def _store_on_disk(self, key, vector):
+        row, digest = self._disk_slot(key)
+        # A colliding text simply takes over the row
+        self._disk[row] = (digest, zlib.crc32(vector.tobytes()), vector)
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, key):
+        """Return the cached vector for `key` from memory or disk, counting the outcome. Call with the lock held."""
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            CACHE_EVENTS.labels('embedding', 'hit').inc()
+            return vector
+        if self._disk is not None:
+            vector = self._load_from_disk(key)
+            if vector is not None:
+                self._remember(key, vector)
+                self.disk_hits += 1
+                CACHE_EVENTS.labels('embedding', 'disk_hit').inc()
+                return vector
+        self.misses += 1
+        CACHE_EVENTS.labels('embedding', 'miss').inc()
+        return None
+
+    def _store(self, key, vector):
+        self._remember(key, vector)
+        if self._disk is not None:
+            try:
+                self._store_on_disk(key, vector)
+            except OSError as e:
+                logging.error(f"Error writing embedding cache {self.disk_path}: {e}")
+
+    def encode(self, text):
+        """Return the embedding for `text`, encoding it only on a cache miss."""
+        with self._lock:
+            vector = self._lookup(text)
+        if vector is not None:
+            return vector
+
+        vector = np.asarray(self._encode(text), dtype=np.float32)
+        with self._lock:
+            self._store(text, vector)
+        return vector
+
+    def encode_many(self, texts):
+        """Return embeddings for `texts`, encoding every miss together in one batch."""
+        vectors = {}
+        missing = []
+        with self._lock:
+            for text in dict.fromkeys(texts):
+                vector = self._lookup(text)
+                if vector is None:
+                    missing.append(text)
+                else:
+                    vectors[text] = vector
+
+        if missing:
+            if self._encode_many:
+                encoded = np.asarray(self._encode_many(missing), dtype=np.float32)
+            else:
+                encoded = [np.asarray(self._encode(text), dtype=np.float32) for text in missing]
+            with self._lock:
+                for text, vector in zip(missing, encoded):
+                    vectors[text] = vector
+                    self._store(text, vector)
+        return [vectors[text] for text in texts]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'disk_slots': len(self._disk) if self._disk is not None else 0,
+            }
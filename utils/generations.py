@@ -0,0 +1,86 @@
+"""
+Immutable on-disk generations behind a CURRENT pointer.
+
+Writers build each version of a data set in a new `gen-<ns>` directory and publish it by
+atomically replacing CURRENT. Readers hold a loaded generation and re-check CURRENT every
+GENERATION_REFRESH_SECONDS, so a new build is picked up without a restart. Superseded
+generations are kept for GENERATION_RETENTION_SECONDS before being deleted, so processes
+still mapping them are never left reading a removed directory.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+from config import GENERATION_REFRESH_SECONDS, GENERATION_RETENTION_SECONDS
+
+def current_generation(path):
+    """Return the directory CURRENT points at, or None if nothing has been published."""
+    pointer = os.path.join(path, 'CURRENT')
+    if not os.path.exists(pointer):
+        return None
+    with open(pointer, 'r', encoding='utf-8') as f:
+        return os.path.join(path, f.read().strip())
+
+def new_generation(path):
+    """Create and return an empty generation directory for a writer to fill."""
+    os.makedirs(path, exist_ok=True)
+    generation = os.path.join(path, f"gen-{time.time_ns()}")
+    os.makedirs(generation)
+    return generation
+
+def publish_generation(path, generation):
+    """Make `generation` current, then delete generations superseded more than the retention ago."""
+    previous = current_generation(path)
+    pointer = os.path.join(path, 'CURRENT')
+    with open(f"{pointer}.tmp", 'w', encoding='utf-8') as f:
+        f.write(os.path.basename(generation))
+    os.replace(f"{pointer}.tmp", pointer)
+    if previous and os.path.isdir(previous):
+        # The directory's mtime records when it stopped being current
+        os.utime(previous)
+    prune_generations(path, keep=generation)
+
+def prune_generations(path, keep, now=None):
+    now = now or time.time()
+    for entry in os.scandir(path):
+        if not entry.is_dir() or not entry.name.startswith('gen-') or entry.path == keep:
+            continue
+        if entry.stat().st_mtime < now - GENERATION_RETENTION_SECONDS:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            logging.info(f"Removed superseded generation {entry.path}")
+
+class GenerationCache:
+    """
+    The loaded current generation of a data set, reloaded when CURRENT moves.
+
+    `load` is called with the generation directory (None when nothing is published) and its
+    result is returned by current() until a re-check finds a different generation. Callers
+    should take one current() per operation, so every step sees the same generation.
+    """
+
+    def __init__(self, path, load, refresh_seconds=GENERATION_REFRESH_SECONDS):
+        self.path = path
+        self._load = load
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._loaded = None
+        self._generation = None
+        self._checked_at = 0.0
+
+    def current(self):
+        if self._loaded is not None and time.monotonic() - self._checked_at < self.refresh_seconds:
+            return self._loaded
+        with self._lock:
+            if self._loaded is None or time.monotonic() - self._checked_at >= self.refresh_seconds:
+                generation = current_generation(self.path)
+                if self._loaded is None or generation != self._generation:
+                    self._loaded = self._load(generation)
+                    self._generation = generation
+                self._checked_at = time.monotonic()
+            return self._loaded
+
+    def invalidate(self):
+        """Force the next current() to re-read CURRENT, e.g. after this process published."""
+        with self._lock:
+            self._checked_at = 0.0
@@ -0,0 +1,140 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InvalidHeader, NewConnectionError
+from urllib3.util.retry import Retry
+from config import (HTTP_POOL_SIZE, HTTP_RETRIES, HTTP_BACKOFF_FACTOR, HTTP_MAX_RETRY_AFTER, HTTP_TIMEOUTS,
+                    HTTP_DEFAULT_TIMEOUT, HTTP_DEADLINES, HTTP_DEFAULT_DEADLINE)
+from utils.metrics import HTTP_REQUESTS, HTTP_CONNECTIONS
+
+# One keep-alive session per host: {host: (session, adapter)}
+_sessions = {}
+_lock = threading.Lock()
+_request_counts = {}
+# Connections per host already added to HTTP_CONNECTIONS
+_reported_connections = {}
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+_retry_after_parser = Retry()
+
+def _create_session():
+    # Retries are handled in request(), where they can be fitted to the request's deadline
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session, adapter
+
+def get_session(host):
+    entry = _sessions.get(host)
+    if entry is None:
+        with _lock:
+            entry = _sessions.get(host)
+            if entry is None:
+                entry = _create_session()
+                _sessions[host] = entry
+    return entry[0]
+
+def _opened_connections(adapter):
+    pools = adapter.poolmanager.pools
+    return sum(pools[key].num_connections for key in list(pools.keys()))
+
+def _report_connections(host):
+    opened = _opened_connections(_sessions[host][1])
+    with _lock:
+        new = opened - _reported_connections.get(host, 0)
+        _reported_connections[host] = opened
+    if new > 0:
+        HTTP_CONNECTIONS.labels(host).inc(new)
+
+def _backoff(attempt):
+    """Exponential backoff spread randomly, so workers don't retry in lockstep."""
+    return random.uniform(0, HTTP_BACKOFF_FACTOR * (2 ** attempt))
+
+def _not_sent(error):
+    """Whether a request failed before it reached the server, so even a POST can be retried."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+def _retry_after(response):
+    """The server's requested wait in seconds, capped at HTTP_MAX_RETRY_AFTER, or None."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return min(_retry_after_parser.parse_retry_after(value), HTTP_MAX_RETRY_AFTER)
+    except InvalidHeader:
+        return None
+
+def request(method, url, idempotent=None, **kwargs):
+    """
+    Send a request through the pooled session for the URL's host, with its timeout budget.
+
+    Connection errors, timeouts and 429/5xx responses are retried up to HTTP_RETRIES times
+    with jittered backoff. Methods that are not idempotent, such as POST, are retried only
+    when the connection could not be made, since the server may already have acted on
+    them; pass `idempotent=True` for a POST that is safe to repeat. The whole call, retries and waits included, is bounded by the
+    host's deadline: each attempt's timeout is shrunk to the time left, and a retry that
+    could not start in time is skipped, returning the last response or raising the last error.
+    """
+    host = urlparse(url).hostname
+    timeout = kwargs.pop('timeout', HTTP_TIMEOUTS.get(host, HTTP_DEFAULT_TIMEOUT))
+    connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    budget = HTTP_DEADLINES.get(host, HTTP_DEFAULT_DEADLINE)
+    deadline = time.monotonic() + budget
+    session = get_session(host)
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        with _lock:
+            _request_counts[host] = _request_counts.get(host, 0) + 1
+        HTTP_REQUESTS.labels(host).inc()
+        try:
+            response = session.request(method, url, timeout=(min(connect_timeout, remaining), min(read_timeout, remaining)),
+                                        **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            delay = _backoff(attempt)
+            if (attempt >= HTTP_RETRIES or not (idempotent or _not_sent(e))
+                    or time.monotonic() + delay + 0.1 >= deadline):
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES or not idempotent or attempt >= HTTP_RETRIES:
+                return response
+            delay = _retry_after(response)
+            delay = _backoff(attempt) if delay is None else delay
+            # Leave room for at least a short attempt after the wait
+            if time.monotonic() + delay + 0.1 >= deadline:
+                return response
+            response.close()
+        finally:
+            _report_connections(host)
+        time.sleep(delay)
+        attempt += 1
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+def get_http_stats():
+    """Return per-host request counts, new connections opened and connections reused."""
+    stats = {}
+    for host, (session, adapter) in list(_sessions.items()):
+        connections = _opened_connections(adapter)
+        requests_sent = _request_counts.get(host, 0)
+        stats[host] = {
+            'requests': requests_sent,
+            'connections': connections,
+            'reused': max(0, requests_sent - connections),
+        }
+    return stats
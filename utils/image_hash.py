@@ -0,0 +1,87 @@
+import json
+import logging
+import time
+import redis
+from PIL import Image
+from utils.resources import get_redis
+from config import IMAGE_HASH_THRESHOLD, IMAGE_HASH_MAX_ENTRIES
+
+# Recognition results for previously processed covers live in Redis, shared by every worker:
+#   <namespace>entry:<hash>          JSON {'hash', 'result', 'search_query'}
+#   <namespace>band:<i>:<bits>       set of hashes whose i-th band has those bits
+#   <namespace>index                 sorted set of hashes by time added, for the size cap
+# Hashes are split into IMAGE_HASH_THRESHOLD + 1 bands, so any two within the threshold agree
+# exactly on at least one band and a lookup only compares hashes sharing a band with it.
+IMAGE_HASH_NAMESPACE = 'imagehash:v1:'
+IMAGE_HASH_INDEX = f"{IMAGE_HASH_NAMESPACE}index"
+
+def dhash(image, hash_size=8):
+    """Compute a 64-bit difference hash of a PIL image."""
+    pixels = list(image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+def _bands(image_hash):
+    """Split a 64-bit hash into IMAGE_HASH_THRESHOLD + 1 bands of near-equal width, as Redis keys."""
+    count = min(IMAGE_HASH_THRESHOLD + 1, 64)
+    keys = []
+    start = 0
+    for band in range(count):
+        width = 64 // count + (band < 64 % count)
+        bits = (image_hash >> start) & ((1 << width) - 1)
+        keys.append(f"{IMAGE_HASH_NAMESPACE}band:{band}:{bits:x}")
+        start += width
+    return keys
+
+def _entry_key(hex_hash):
+    return f"{IMAGE_HASH_NAMESPACE}entry:{hex_hash}"
+
+def find_similar(image_hash):
+    """Return the closest indexed entry within IMAGE_HASH_THRESHOLD bits, or None."""
+    if IMAGE_HASH_THRESHOLD < 0:
+        return None
+    try:
+        candidates = [member.decode('utf-8') for member in get_redis().sunion(_bands(image_hash))]
+        best_hash, best_distance = None, IMAGE_HASH_THRESHOLD + 1
+        for candidate in candidates:
+            distance = hamming_distance(image_hash, int(candidate, 16))
+            if distance < best_distance:
+                best_hash, best_distance = candidate, distance
+        raw = get_redis().get(_entry_key(best_hash)) if best_hash else None
+    except redis.exceptions.RedisError as e:
+        logging.warning(f"Image hash lookup failed: {e}")
+        return None
+    if not raw:
+        return None
+    logging.info(f"Image hash {image_hash:016x} matches {best_hash} at distance {best_distance}")
+    return json.loads(raw)
+
+def _forget(client, hex_hash):
+    client.delete(_entry_key(hex_hash))
+    for band in _bands(int(hex_hash, 16)):
+        client.srem(band, hex_hash)
+
+def remember(image_hash, result, search_query):
+    """Add a recognition result to the index, evicting the oldest beyond IMAGE_HASH_MAX_ENTRIES."""
+    if IMAGE_HASH_THRESHOLD < 0:
+        return
+    hex_hash = f"{image_hash:016x}"
+    try:
+        client = get_redis()
+        client.set(_entry_key(hex_hash), json.dumps({'hash': hex_hash, 'result': result, 'search_query': search_query}))
+        for band in _bands(image_hash):
+            client.sadd(band, hex_hash)
+        client.zadd(IMAGE_HASH_INDEX, {hex_hash: time.time()})
+        overflow = client.zcard(IMAGE_HASH_INDEX) - IMAGE_HASH_MAX_ENTRIES
+        if overflow > 0:
+            for member, _ in client.zpopmin(IMAGE_HASH_INDEX, overflow):
+                _forget(client, member.decode('utf-8'))
+    except redis.exceptions.RedisError as e:
+        logging.error(f"Error writing image hash index: {e}")
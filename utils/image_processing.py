@@ -1,23 +1,39 @@
-import anthropic
 import base64
 import os
 import re
-from google.cloud import vision
-from google.oauth2 import service_account
 from PIL import Image
 import io
+import threading
+import time
+from utils.image_hash import dhash, find_similar, remember
+from utils.resources import get_vision_client, get_anthropic_client
+from utils.metrics import span, CACHE_EVENTS, UPSTREAM_BYTES
+from config import RECOGNITION_STRATEGY, OCR_CONFIDENCE_THRESHOLD, MAX_IMAGE_EDGE, JPEG_QUALITY
 
-# Initialize Google Vision client
-credentials_path = "D:\\projects\\2024\\Q3\\collectorsage\\collectorsage-eec946bf70cd.json"
-credentials = service_account.Credentials.from_service_account_file(credentials_path)
-vision_client = vision.ImageAnnotatorClient(credentials=credentials)
+OCR_ISSUE_PATTERN = re.compile(r'(?:#|\bNo\.?\s*|\bIssue\s+)(\d{1,4})\b', re.IGNORECASE)
+OCR_YEAR_PATTERN = re.compile(r'\b(19[3-9]\d|20[0-4]\d)\b')
+OCR_NOISE_LINES = {'MARVEL', 'MARVEL COMICS', 'MARVEL COMICS GROUP', 'DC', 'DC COMICS', 'IMAGE', 'DARK HORSE',
+                   'COMICS', 'COMICS CODE', 'AUTHORITY', 'PRESENTS', 'VOLUME', 'VOL'}
 
-def recognize_comic_issue_with_google_vision(image_path):
-    with open(image_path, 'rb') as image_file:
-        content = image_file.read()
+recognition_stats = {
+    strategy: {'calls': 0, 'recognized': 0, 'ocr_hits': 0, 'claude_calls': 0, 'total_ms': 0.0}
+    for strategy in ('claude', 'ocr', 'ocr_fallback')
+}
+if RECOGNITION_STRATEGY not in recognition_stats:
+    raise ValueError(f"Unknown RECOGNITION_STRATEGY: {RECOGNITION_STRATEGY}")
+# Recognition runs on request and batch worker threads
+_stats_lock = threading.Lock()
 
-    image = vision.Image(content=content)
-    response = vision_client.text_detection(image=image)
+def _count(counter, amount=1):
+    with _stats_lock:
+        recognition_stats[RECOGNITION_STRATEGY][counter] += amount
+
+def recognize_comic_issue_with_google_vision(image_bytes):
+    from google.cloud import vision
+    image = vision.Image(content=image_bytes)
+    UPSTREAM_BYTES.labels('google_vision').inc(len(image_bytes))
+    with span('ocr'):
+        response = get_vision_client().text_detection(image=image)
     texts = response.text_annotations
 
     if texts:
@@ -28,48 +44,59 @@ def recognize_comic_issue_with_google_vision(image_path):
         print("No text recognized.")
         return None
 
-def convert_image_to_jpg(image_path):
-    with open(image_path, 'rb') as image_file:
-        image = Image.open(image_file)
+def prepare_image(source):
+    """
+    Decode an upload once, cap its long edge at MAX_IMAGE_EDGE and encode it as JPEG.
+
+    `source` is a path, the raw image bytes or a binary file object. Returns (image, jpeg_bytes): the downscaled RGB image for local work such as hashing,
+    and the single encoded buffer shared by every recognizer.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with Image.open(source) as image:
+        # For JPEGs this lets the decoder skip straight to a reduced scale
+        image.draft('RGB', (MAX_IMAGE_EDGE, MAX_IMAGE_EDGE))
         image = image.convert('RGB')
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG")
-        return buffered.getvalue()
-
-def get_comic_details_with_claude(image_path):
-    base64_image = base64.b64encode(convert_image_to_jpg(image_path)).decode('utf-8')
-
-    client = anthropic.Client(api_key=os.getenv('ANTHROPIC_API_KEY'))
-    response = client.messages.create(
-        model="claude-3-5-sonnet-20240620",
-        max_tokens=1024,
-        messages=[
-            {
-                "role": "user", 
-                "content": [
-                    {
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": "image/jpeg",
-                            "data": base64_image
+    image.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=JPEG_QUALITY)
+    return image, buffered.getvalue()
+
+def get_comic_details_with_claude(image_bytes):
+    base64_image = base64.b64encode(image_bytes).decode('utf-8')
+
+    UPSTREAM_BYTES.labels('anthropic').inc(len(base64_image))
+    with span('claude_recognition'):
+        response = get_anthropic_client().messages.create(
+            model="claude-3-5-sonnet-20240620",
+            max_tokens=1024,
+            messages=[
+                {
+                    "role": "user", 
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": "image/jpeg",
+                                "data": base64_image
+                            }
+                        },
+                        {
+                            "type": "text",
+                            "text": (
+                                "Given the following image, provide the title, issue number, volume, and publication year of the comic book.\n\n"
+                                "Provide the information in the following format:\n"
+                                "Title: <Title>\n"
+                                "Issue Number: <Issue Number>\n"
+                                "Volume: <Volume>\n"
+                                "Year: <Year>"
+                            )
                         }
-                    },
-                    {
-                        "type": "text",
-                        "text": (
-                            "Given the following image, provide the title, issue number, volume, and publication year of the comic book.\n\n"
-                            "Provide the information in the following format:\n"
-                            "Title: <Title>\n"
-                            "Issue Number: <Issue Number>\n"
-                            "Volume: <Volume>\n"
-                            "Year: <Year>"
-                        )
-                    }
-                ]
-            }
-        ]
-    )
+                    ]
+                }
+            ]
+        )
 
     if response and response.content:
         text_blocks = [block.text for block in response.content if block.type == 'text']
@@ -93,58 +120,151 @@ def parse_comic_details(text):
             details['year'] = line.replace("Year: ", "").strip()
     return details
 
-def process_comic_image(image_path):
+def process_comic_image(source):
+    """Recognize the comic in `source` (a path, bytes or binary file object). Returns (details, search_query)."""
     print("Processing comic image...")
-    recognized_text = recognize_comic_issue_with_google_vision(image_path)
+    image, image_bytes = prepare_image(source)
+    image_hash = dhash(image)
+    cached = find_similar(image_hash)
+    CACHE_EVENTS.labels('image_hash', 'hit' if cached else 'miss').inc()
+    if cached:
+        print(f"Reusing recognition result for near-duplicate image: {cached['result']}")
+        return cached['result'], cached['search_query']
 
-    if recognized_text:
+    result, search_query = recognize_comic_image(image_bytes)
+    if result:
+        remember(image_hash, result, search_query)
+    return result, search_query
+
+def parse_ocr_text(text):
+    """
+    Extract title, issue number and year from cover OCR text without a remote call.
+
+    Returns (details, confidence) where confidence is between 0 and 1.
+    """
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    details = {}
+    confidence = 0.0
+
+    issue_match = OCR_ISSUE_PATTERN.search(text)
+    if issue_match:
+        details['issue_number'] = issue_match.group(1)
+        confidence += 0.4
+
+    year_match = OCR_YEAR_PATTERN.search(text)
+    if year_match:
+        details['year'] = year_match.group(1)
+        confidence += 0.2
+
+    # The masthead is usually the longest mostly-alphabetic line that is not cover boilerplate
+    candidates = [
+        line for line in lines
+        if len(re.sub(r'[^A-Za-z]', '', line)) >= 3
+        and line.upper() not in OCR_NOISE_LINES
+        and not OCR_ISSUE_PATTERN.search(line)
+        and not OCR_YEAR_PATTERN.search(line)
+        and not re.search(r'\d+\s*[¢c]\b|approved by|comics code', line, re.IGNORECASE)
+    ]
+    if candidates:
+        title = max(candidates[:5], key=len)
+        position = candidates.index(title)
+        following = candidates[position + 1] if position + 1 < len(candidates) else None
+        if following and len(title.split()) <= 2 and len(following.split()) <= 2:
+            # Mastheads are often split across lines ("THE INCREDIBLE" / "HULK"); join them but trust it less
+            details['title'] = f"{title} {following}".title()
+            confidence += 0.2
+        else:
+            details['title'] = title.title()
+            confidence += 0.4
+
+    return details, confidence
+
+def _recognize_details(image_bytes):
+    """Get raw comic details according to RECOGNITION_STRATEGY."""
+    if RECOGNITION_STRATEGY == 'claude':
         print("Getting comic details with Claude...")
-        comic_details = get_comic_details_with_claude(image_path)
-        if comic_details:
-            print(f"Comic details recognized: {comic_details}")
-            
-            # Extract and clean up title
-            title = comic_details.get('title', '').strip()
-            if not title:
-                title = "Unknown Title"
-            
-            # Handle issue number
-            issue_number = comic_details.get('issue_number', '').strip()
-            if not issue_number or 'not specified' in issue_number.lower():
-                issue_number = ''
-            
-            # Extract year, if present
-            year = comic_details.get('year', '').strip()
-            year_match = re.search(r'\d{4}', year)
-            if year_match:
-                year = year_match.group()
-            else:
-                year = ''
-            
-            # Prepare search query
-            search_terms = [title]
-            if issue_number:
-                search_terms.append(issue_number)
-            if year:
-                search_terms.append(year)
-            
-            search_query = " ".join(search_terms).strip()
-            
-            # Prepare comic details for return
-            cleaned_details = {
-                'title': title,
-                'issue_number': issue_number if issue_number else 'N/A',
-                'volume': comic_details.get('volume', 'N/A'),
-                'year': year if year else 'N/A'
-            }
-            
-            print(f"Fetching eBay data for query: {search_query}")
-            return cleaned_details, search_query
+        _count('claude_calls')
+        return get_comic_details_with_claude(image_bytes)
+
+    recognized_text = recognize_comic_issue_with_google_vision(image_bytes)
+    if recognized_text:
+        details, confidence = parse_ocr_text(recognized_text)
+        print(f"Local OCR parse: {details} (confidence {confidence:.2f})")
+        if details.get('title') and (RECOGNITION_STRATEGY == 'ocr' or confidence >= OCR_CONFIDENCE_THRESHOLD):
+            _count('ocr_hits')
+            return details
+        if RECOGNITION_STRATEGY == 'ocr':
+            return None
+    elif RECOGNITION_STRATEGY == 'ocr':
+        print("No text recognized in the image.")
+        return None
+
+    print("Falling back to Claude for comic details...")
+    _count('claude_calls')
+    return get_comic_details_with_claude(image_bytes)
+
+def get_recognition_stats():
+    """Return per-strategy call counts, hit rates and mean latency."""
+    with _stats_lock:
+        summary = {strategy: dict(stats) for strategy, stats in recognition_stats.items()}
+    for stats in summary.values():
+        calls = stats['calls']
+        stats['hit_rate'] = stats['recognized'] / calls if calls else 0.0
+        stats['ocr_hit_rate'] = stats['ocr_hits'] / calls if calls else 0.0
+        stats['avg_latency_ms'] = stats['total_ms'] / calls if calls else 0.0
+    return summary
+
+def recognize_comic_image(image_bytes):
+    start = time.perf_counter()
+    try:
+        comic_details = _recognize_details(image_bytes)
+    finally:
+        _count('calls')
+        _count('total_ms', (time.perf_counter() - start) * 1000)
+
+    if comic_details:
+        _count('recognized')
+        print(f"Comic details recognized: {comic_details}")
+        
+        # Extract and clean up title
+        title = comic_details.get('title', '').strip()
+        if not title:
+            title = "Unknown Title"
+        
+        # Handle issue number
+        issue_number = comic_details.get('issue_number', '').strip()
+        if not issue_number or 'not specified' in issue_number.lower():
+            issue_number = ''
+        
+        # Extract year, if present
+        year = comic_details.get('year', '').strip()
+        year_match = re.search(r'\d{4}', year)
+        if year_match:
+            year = year_match.group()
         else:
-            print("No comic details recognized.")
-            return None, None
+            year = ''
+        
+        # Prepare search query
+        search_terms = [title]
+        if issue_number:
+            search_terms.append(issue_number)
+        if year:
+            search_terms.append(year)
+        
+        search_query = " ".join(search_terms).strip()
+        
+        # Prepare comic details for return
+        cleaned_details = {
+            'title': title,
+            'issue_number': issue_number if issue_number else 'N/A',
+            'volume': comic_details.get('volume', 'N/A'),
+            'year': year if year else 'N/A'
+        }
+        
+        print(f"Fetching eBay data for query: {search_query}")
+        return cleaned_details, search_query
     else:
-        print("No text recognized in the image.")
+        print("No comic details recognized.")
         return None, None
 
 # Example usage
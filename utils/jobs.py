@@ -0,0 +1,199 @@
+import ipaddress
+import json
+import logging
+import socket
+import time
+import uuid
+from urllib.parse import urlparse
+import certifi
+import redis
+import urllib3
+from utils.pipeline import appraise_comic
+from utils.resources import get_redis, get_anthropic_client
+from utils.upload_store import pin, unpin
+from config import JOB_TTL, JOB_STALE_SECONDS, WEBHOOK_ALLOWED_HOSTS, WEBHOOK_TIMEOUT
+
+JOB_QUEUE_KEY = 'jobs:queue'
+# Jobs a worker has taken but not finished; removed once the job's result is recorded
+JOB_PROCESSING_KEY = 'jobs:processing'
+
+def _job_key(job_id):
+    return f"job:{job_id}"
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+def enqueue_job(job_id, image_path, webhook_url=None):
+    """Record a queued job for an already stored upload and push it onto the work queue."""
+    now = time.time()
+    key = _job_key(job_id)
+    get_redis().hset(key, mapping={
+        'status': 'queued',
+        'image_path': image_path,
+        'webhook_url': webhook_url or '',
+        'created_at': now,
+        'updated_at': now,
+    })
+    get_redis().expire(key, JOB_TTL)
+    pin(job_id, image_path)
+    get_redis().lpush(JOB_QUEUE_KEY, job_id)
+    return job_id
+
+def _update_job(job_id, **fields):
+    fields['updated_at'] = time.time()
+    get_redis().hset(_job_key(job_id), mapping=fields)
+
+def get_job(job_id):
+    """Return the public view of a job, or None if it is unknown or expired."""
+    raw = get_redis().hgetall(_job_key(job_id))
+    if not raw:
+        return None
+    job = {key.decode('utf-8'): value.decode('utf-8') for key, value in raw.items()}
+    view = {
+        'jobId': job_id,
+        'status': job['status'],
+        'createdAt': float(job['created_at']),
+        'updatedAt': float(job['updated_at']),
+    }
+    if 'result' in job:
+        view['statusCode'] = int(job['status_code'])
+        view['result'] = json.loads(job['result'])
+    return view
+
+def validate_webhook_url(webhook_url):
+    """
+    Raise ValueError unless the URL is safe for the server to POST to.
+
+    Webhooks must be https, and either on WEBHOOK_ALLOWED_HOSTS or, with no allowlist
+    configured, resolve only to public addresses, so a caller cannot point the server at
+    loopback, private or link-local services. Returns the address to connect to: one of the
+    checked addresses, or the host itself when it is allowlisted.
+    """
+    parsed = urlparse(webhook_url)
+    if parsed.scheme != 'https' or not parsed.hostname:
+        raise ValueError("Webhook URL must be an https URL")
+    host = parsed.hostname.lower()
+    if WEBHOOK_ALLOWED_HOSTS:
+        if host not in WEBHOOK_ALLOWED_HOSTS:
+            raise ValueError(f"Webhook host {host} is not allowed")
+        return host
+
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parsed.port or 443, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError) as e:
+        raise ValueError(f"Webhook host {host} does not resolve") from e
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"Webhook host {host} resolves to a non-public address")
+    return sorted(addresses)[0]
+
+def _post_webhook(webhook_url, address, job):
+    """
+    POST the job to the webhook over a connection to `address`, verifying the certificate for the URL's host.
+
+    Connecting to the address that was validated, rather than resolving the host again, stops
+    a DNS rebind from redirecting the request. Each delivery uses its own connection pool, so
+    client-chosen hosts never join http_client's per-host pools or metrics. Returns the status.
+    """
+    parsed = urlparse(webhook_url)
+    host = parsed.hostname
+    host_header = f"[{host}]" if ':' in host else host
+    if parsed.port:
+        host_header = f"{host_header}:{parsed.port}"
+    path = (parsed.path or '/') + (f"?{parsed.query}" if parsed.query else '')
+    pool = urllib3.HTTPSConnectionPool(
+        address, port=parsed.port or 443, server_hostname=host, assert_hostname=host,
+        cert_reqs='CERT_REQUIRED', ca_certs=certifi.where(),
+        timeout=urllib3.Timeout(connect=WEBHOOK_TIMEOUT[0], read=WEBHOOK_TIMEOUT[1]), retries=False,
+    )
+    try:
+        response = pool.urlopen('POST', path, body=json.dumps(job).encode('utf-8'), redirect=False,
+                                headers={'Host': host_header, 'Content-Type': 'application/json'})
+        return response.status
+    finally:
+        pool.close()
+
+def _notify_webhook(webhook_url, job):
+    try:
+        # Checked again at delivery, since the host's DNS may have changed since the job was queued
+        address = validate_webhook_url(webhook_url)
+    except ValueError as e:
+        logging.warning(f"Not delivering webhook for job {job['jobId']}: {e}")
+        return
+    try:
+        status = _post_webhook(webhook_url, address, job)
+    except urllib3.exceptions.HTTPError as e:
+        logging.warning(f"Webhook delivery to {webhook_url} failed for job {job['jobId']}: {e}")
+        return
+    if status >= 400:
+        logging.warning(f"Webhook delivery to {webhook_url} failed for job {job['jobId']}: status {status}")
+
+def process_job(job_id):
+    job = get_redis().hgetall(_job_key(job_id))
+    if not job:
+        logging.warning(f"Job {job_id} expired before it was processed")
+        return
+    image_path = job[b'image_path'].decode('utf-8')
+    webhook_url = job[b'webhook_url'].decode('utf-8')
+
+    _update_job(job_id, status='running')
+    try:
+        body, status_code = appraise_comic(image_path, get_anthropic_client())
+    except Exception:
+        logging.exception(f"Error processing job {job_id}")
+        body, status_code = {'error': 'An unexpected error occurred'}, 500
+
+    _update_job(job_id, status='done' if status_code == 200 else 'failed',
+                status_code=status_code, result=json.dumps(body))
+    unpin(job_id, image_path)
+    if webhook_url:
+        _notify_webhook(webhook_url, get_job(job_id))
+
+def requeue_stale_jobs(now=None):
+    """
+    Put jobs left in the processing list by a crashed worker back on the queue.
+
+    A job counts as abandoned once it has not been updated for JOB_STALE_SECONDS. Returns the
+    number of jobs requeued.
+    """
+    now = now or time.time()
+    requeued = 0
+    for raw_id in get_redis().lrange(JOB_PROCESSING_KEY, 0, -1):
+        job_id = raw_id.decode('utf-8')
+        updated_at = get_redis().hget(_job_key(job_id), 'updated_at')
+        if updated_at is not None and float(updated_at) > now - JOB_STALE_SECONDS:
+            continue
+        # Only the worker that removes the entry requeues it
+        if get_redis().lrem(JOB_PROCESSING_KEY, 1, raw_id):
+            if updated_at is not None:
+                _update_job(job_id, status='queued')
+                get_redis().rpush(JOB_QUEUE_KEY, job_id)
+                requeued += 1
+    if requeued:
+        logging.warning(f"Requeued {requeued} abandoned jobs")
+    return requeued
+
+def run_worker(poll_timeout=5):
+    """
+    Process queued jobs forever.
+
+    Each job is moved atomically onto the processing list as it is taken and removed only
+    once its result is recorded, so a job whose worker dies is requeued rather than lost.
+    Redis errors are logged and retried after a pause; a job interrupted by one stays on the
+    processing list and is requeued once it goes stale.
+    """
+    logging.info("Job worker started")
+    last_check = 0.0
+    while True:
+        try:
+            if time.time() - last_check >= JOB_STALE_SECONDS / 2:
+                requeue_stale_jobs()
+                last_check = time.time()
+            raw_id = get_redis().brpoplpush(JOB_QUEUE_KEY, JOB_PROCESSING_KEY, timeout=poll_timeout)
+            if raw_id:
+                process_job(raw_id.decode('utf-8'))
+                get_redis().lrem(JOB_PROCESSING_KEY, 1, raw_id)
+        except redis.exceptions.RedisError as e:
+            logging.error(f"Redis error in job worker, retrying in {poll_timeout}s: {e}")
+            time.sleep(poll_timeout)
@@ -0,0 +1,81 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+STAGE_LATENCY = Histogram(
+    'collectorsage_stage_seconds', 'Time spent in each pipeline stage', ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30),
+)
+STAGE_ERRORS = Counter('collectorsage_stage_errors_total', 'Pipeline stages that raised', ['stage'])
+UPSTREAM_ERRORS = Counter('collectorsage_upstream_errors_total', 'Failed calls to external services', ['service'])
+CACHE_EVENTS = Counter('collectorsage_cache_events_total', 'Cache lookups by cache and result', ['cache', 'result'])
+UPLOAD_BYTES = Counter('collectorsage_upload_bytes_total', 'Bytes received in image uploads')
+UPSTREAM_BYTES = Counter('collectorsage_upstream_bytes_total', 'Image bytes sent to external services', ['service'])
+HTTP_REQUESTS = Counter('collectorsage_http_requests_total', 'Outbound HTTP requests by host', ['host'])
+HTTP_CONNECTIONS = Counter('collectorsage_http_connections_total', 'Outbound HTTP connections opened by host', ['host'])
+
+# Spans recorded for the request being handled; shared with pipeline threads via copied contexts
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+def start_request():
+    """Begin collecting spans for the current request and return the list they go into."""
+    spans = []
+    _request_spans.set(spans)
+    return spans
+
+@contextmanager
+def span(stage):
+    """Time a block as a pipeline stage, feeding the histogram and the request's spans."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage).observe(elapsed)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+def server_timing_header(spans):
+    """Format spans as a Server-Timing header value, in milliseconds."""
+    return ', '.join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in spans)
+
+class StatsCollector:
+    """Expose the rates the recognizer and catalogue lookups already keep, read at scrape time."""
+
+    def describe(self):
+        # Registering would otherwise call collect() while the modules it reads are still importing
+        return []
+
+    def collect(self):
+        from utils.database import get_exact_match_stats
+        from utils.image_processing import get_recognition_stats
+
+        recognition = GaugeMetricFamily('collectorsage_recognition_hit_rate', 'Share of scans recognized per strategy',
+                                        labels=['strategy'])
+        for strategy, stats in get_recognition_stats().items():
+            recognition.add_metric([strategy], stats['hit_rate'])
+        yield recognition
+
+        yield GaugeMetricFamily('collectorsage_exact_match_hit_rate',
+                                'Share of catalogue lookups answered by the exact-match index',
+                                value=get_exact_match_stats()['hit_rate'])
+
+REGISTRY.register(StatsCollector())
+
+def render_metrics():
+    """Render all metrics in the Prometheus text format, merging workers in multiprocess mode."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # Counters are merged across workers; the collector's rates describe the worker answering the scrape
+        registry.register(StatsCollector())
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
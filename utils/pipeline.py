@@ -0,0 +1,227 @@
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime
+from utils.image_processing import process_comic_image
+from utils.report_generation import generate_qualitative_report, stream_qualitative_report
+from utils.ebay import fetch_ebay_data, calculate_sales_trend
+from utils.database import fetch_database_info, fetch_price_distribution
+from utils.currency_conversion import convert_many
+from config import PIPELINE_MAX_WORKERS, STAGE_TIMEOUTS
+
+executor = ThreadPoolExecutor(max_workers=PIPELINE_MAX_WORKERS, thread_name_prefix='pipeline')
+
+def run_stages(stages):
+    """
+    Run independent stages concurrently on the shared thread pool.
+
+    `stages` maps a stage name to a zero-argument callable. Each stage is bounded by its
+    entry in STAGE_TIMEOUTS; a stage that fails or times out is reported in `errors`
+    instead of failing the others. Returns (results, errors, timings_ms).
+    """
+    started = {}
+    finished = {}
+
+    def wrap(name, func):
+        def run():
+            started[name] = time.perf_counter()
+            try:
+                return func()
+            finally:
+                finished[name] = time.perf_counter()
+        return run
+
+    submitted_at = time.perf_counter()
+    # Each stage runs in a copy of the caller's context so its spans land in the same request
+    futures = {name: executor.submit(contextvars.copy_context().run, wrap(name, func)) for name, func in stages.items()}
+
+    results, errors, timings = {}, {}, {}
+    for name, future in futures.items():
+        timeout = STAGE_TIMEOUTS.get(name)
+        remaining = None if timeout is None else max(0.0, submitted_at + timeout - time.perf_counter())
+        try:
+            results[name] = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            future.cancel()
+            logging.error(f"Stage '{name}' timed out after {timeout}s")
+            errors[name] = 'timeout'
+        except Exception as e:
+            logging.exception(f"Stage '{name}' failed")
+            errors[name] = str(e)
+
+        end = finished.get(name, time.perf_counter())
+        timings[name] = round((end - started.get(name, submitted_at)) * 1000, 1)
+
+    return results, errors, timings
+
+def fetch_ebay_prices(search_query):
+    """Fetch eBay sold listings for a query and convert their prices to GBP."""
+    ebay_data = fetch_ebay_data(search_query)
+    if not ebay_data or 'itemSummaries' not in ebay_data:
+        return ebay_data, [], []
+
+    items = ebay_data.get('itemSummaries', [])
+    items = sorted(items, key=lambda x: float(x['price']['value']), reverse=True)
+
+    priced_items = [item for item in items if item.get('price', {}).get('value')]
+    prices = convert_many([float(item['price']['value']) for item in priced_items],
+                          [item['price'].get('currency', 'USD') for item in priced_items])
+    return ebay_data, items, prices
+
+class AppraisalError(Exception):
+    """A pipeline step could not produce what the report needs; carries the error response."""
+
+    def __init__(self, body, status):
+        super().__init__(body.get('error'))
+        self.body = body
+        self.status = status
+
+def recognize_comic(image, timings):
+    """Identify the comic in the image (a path, bytes or binary file object). Returns (details, search_query)."""
+    start = time.perf_counter()
+    result, search_query = process_comic_image(image)
+    timings['recognition'] = round((time.perf_counter() - start) * 1000, 1)
+
+    if not result:
+        raise AppraisalError({'error': 'Failed to process image'}, 500)
+
+    logging.debug(f"Comic details - Title: {result['title']}, Issue Number: {result['issue_number']}, Year: {result['year']}")
+    return result, search_query
+
+def gather_market_data(details, search_query, timings):
+    """
+    Look up database and eBay prices for a recognized comic.
+
+    The database lookup and the eBay search (with currency conversion) only depend on the
+    recognized comic, so they run concurrently. Returns (report_inputs, prices, errors), where
+    report_inputs are the keyword arguments of generate_qualitative_report minus the client
+    and prices are the eBay prices converted to GBP.
+    """
+    title = details['title']
+    issue_number = details['issue_number']
+
+    results, errors, stage_timings = run_stages({
+        'database': lambda: fetch_database_info(title, issue_number, details['year']),
+        'ebay': lambda: fetch_ebay_prices(search_query),
+    })
+    timings.update(stage_timings)
+
+    # A failed database lookup only weakens the report; carry on without it
+    database_prices, metadata = results.get('database', ([], None))
+    logging.debug(f"Database Prices: {database_prices}")
+
+    if database_prices:
+        database_avg_price = sum(database_prices) / len(database_prices)
+    else:
+        database_avg_price = 0.0
+
+    logging.debug(f"Database Average Price: £{database_avg_price:.2f}")
+
+    if 'ebay' in errors:
+        status = 504 if errors['ebay'] == 'timeout' else 502
+        raise AppraisalError({'error': 'eBay lookup failed', 'errors': errors}, status)
+
+    ebay_data, items, prices = results['ebay']
+    if not ebay_data or 'itemSummaries' not in ebay_data:
+        raise AppraisalError({'error': 'No eBay data found or missing itemSummaries'}, 404)
+
+    if not prices:
+        raise AppraisalError({'error': 'No valid prices found'}, 404)
+
+    avg_price = sum(prices) / len(prices)
+    logging.debug(f"Average eBay Price: £{avg_price:.2f}")
+
+    sold_dates = [datetime.strptime(item['itemEndDate'], '%Y-%m-%dT%H:%M:%S.%fZ') for item in items if 'itemEndDate' in item]
+    sales_trend = calculate_sales_trend(sold_dates)
+
+    report_inputs = {
+        'title': title,
+        'issue_number': issue_number,
+        'year': details['year'],
+        'avg_price': avg_price,
+        'database_avg_price': database_avg_price,
+        'ebay_data': ebay_data,
+        'sales_trend': sales_trend,
+        'metadata': metadata,
+    }
+    return report_inputs, prices, errors
+
+def comic_details_view(details):
+    return {
+        'title': details['title'],
+        'issueNumber': details['issue_number'],
+        'year': details['year']
+    }
+
+def price_summary(report_inputs, prices):
+    """
+    The price figures the report is based on, in GBP and the response's camelCase, plus the
+    distribution of catalogue prices for the issue when the catalogue store has it.
+    """
+    summary = {
+        'averageEbayPrice': round(report_inputs['avg_price'], 2),
+        'databaseAveragePrice': round(report_inputs['database_avg_price'], 2),
+        'ebayMinPrice': round(min(prices), 2),
+        'ebayMaxPrice': round(max(prices), 2),
+        'listings': len(report_inputs['ebay_data']['itemSummaries']),
+        'salesTrend': report_inputs['sales_trend'],
+    }
+    distribution = fetch_price_distribution(report_inputs['title'], report_inputs['issue_number'],
+                                            report_inputs['year'])
+    if distribution:
+        summary['databaseDistribution'] = distribution
+    return summary
+
+def appraise_comic(image, client):
+    """
+    Run the full recognition -> lookup -> report pipeline for one image.
+
+    `image` is a path, the image bytes or a binary file object. Returns (response_body, status_code).
+    """
+    timings = {}
+    try:
+        details, search_query = recognize_comic(image, timings)
+        report_inputs, prices, errors = gather_market_data(details, search_query, timings)
+    except AppraisalError as e:
+        return dict(e.body, timings=timings), e.status
+
+    start = time.perf_counter()
+    qualitative_report = generate_qualitative_report(client=client, **report_inputs)
+    timings['report'] = round((time.perf_counter() - start) * 1000, 1)
+
+    body = {'comicDetails': comic_details_view(details), 'report': qualitative_report, 'timings': timings}
+    if errors:
+        body['errors'] = errors
+    return body, 200
+
+def appraise_comic_events(image, client):
+    """
+    Run the pipeline for one image, yielding (event, data) pairs as each part is ready.
+
+    Emits 'details' once the comic is recognized, 'prices' once the lookups finish, a
+    'report' event per chunk of report text, then 'done' with the timings. A failed step
+    ends the stream with a single 'error' event carrying the usual error body and status.
+    """
+    timings = {}
+    try:
+        details, search_query = recognize_comic(image, timings)
+        yield 'details', comic_details_view(details)
+        report_inputs, prices, errors = gather_market_data(details, search_query, timings)
+    except AppraisalError as e:
+        yield 'error', dict(e.body, timings=timings, status=e.status)
+        return
+
+    summary = price_summary(report_inputs, prices)
+    if errors:
+        summary['errors'] = errors
+    yield 'prices', summary
+
+    start = time.perf_counter()
+    for chunk in stream_qualitative_report(client=client, **report_inputs):
+        if 'report_first_token' not in timings:
+            timings['report_first_token'] = round((time.perf_counter() - start) * 1000, 1)
+        yield 'report', {'text': chunk}
+    timings['report'] = round((time.perf_counter() - start) * 1000, 1)
+
+    yield 'done', {'timings': timings}
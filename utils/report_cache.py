@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import math
+import time
+import redis
+from utils.resources import get_redis
+from utils.ebay import normalize_query
+from utils.metrics import CACHE_EVENTS
+from config import REPORT_CACHE_TTL, REPORT_CACHE_MAX_ENTRIES, REPORT_CACHE_PRICE_BUCKET, REPORT_CACHE_MAX_DRIFT
+
+REPORT_CACHE_NAMESPACE = 'report:v1:'
+# Sorted set of cached report keys by creation time, used to evict the oldest past the size cap
+REPORT_CACHE_INDEX = f"{REPORT_CACHE_NAMESPACE}index"
+
+PRICE_FIGURES = ('avg_price', 'ebay_min_price', 'ebay_max_price', 'db_min_price', 'db_max_price', 'database_avg_price')
+
+def _identity(title, issue_number, year):
+    return normalize_query(f"{title} {issue_number} {year}")
+
+def _bucket(value):
+    """Map a price onto a log scale with REPORT_CACHE_PRICE_BUCKET relative width per step."""
+    if not isinstance(value, (int, float)) or value <= 0:
+        return str(value)
+    return str(math.floor(math.log(value) / math.log1p(REPORT_CACHE_PRICE_BUCKET)))
+
+def fingerprint(figures):
+    """Bucketed summary of the price inputs; reports with the same fingerprint are interchangeable."""
+    parts = [_bucket(figures[name]) for name in PRICE_FIGURES]
+    parts.append(str(figures['sales_trend']))
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+def _cache_key(identity, figures):
+    return f"{REPORT_CACHE_NAMESPACE}{identity}:{fingerprint(figures)}"
+
+def _latest_key(identity):
+    return f"{REPORT_CACHE_NAMESPACE}latest:{identity}"
+
+def _within_drift(cached_figures, figures):
+    """True if no price moved more than REPORT_CACHE_MAX_DRIFT (relative) and the trend is unchanged."""
+    if cached_figures.get('sales_trend') != figures['sales_trend']:
+        return False
+    for name in PRICE_FIGURES:
+        old, new = cached_figures.get(name), figures[name]
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+            if old != new:
+                return False
+        elif abs(new - old) > REPORT_CACHE_MAX_DRIFT * max(abs(old), 0.01):
+            return False
+    return True
+
+def get_cached_report(title, issue_number, year, figures):
+    """
+    Return a cached report for this comic and market, or None.
+
+    A report is reused when its price fingerprint matches. With REPORT_CACHE_MAX_DRIFT set, the
+    comic's most recent report is also reused as long as its prices are still within the drift.
+    """
+    identity = _identity(title, issue_number, year)
+    try:
+        raw = get_redis().get(_cache_key(identity, figures))
+        if raw:
+            CACHE_EVENTS.labels('report', 'hit').inc()
+            return json.loads(raw)['report']
+
+        if REPORT_CACHE_MAX_DRIFT > 0:
+            latest = get_redis().get(_latest_key(identity))
+            raw = get_redis().get(latest.decode('utf-8')) if latest else None
+            if raw:
+                entry = json.loads(raw)
+                if _within_drift(entry['figures'], figures):
+                    CACHE_EVENTS.labels('report', 'drift_hit').inc()
+                    return entry['report']
+    except (redis.exceptions.RedisError, ValueError, KeyError) as e:
+        logging.warning(f"Report cache lookup failed for {identity}: {e}")
+
+    CACHE_EVENTS.labels('report', 'miss').inc()
+    return None
+
+def cache_report(title, issue_number, year, figures, report):
+    """Store a freshly generated report, evicting the oldest entries beyond REPORT_CACHE_MAX_ENTRIES."""
+    if not report or REPORT_CACHE_TTL <= 0:
+        return
+    identity = _identity(title, issue_number, year)
+    key = _cache_key(identity, figures)
+    now = time.time()
+    entry = {'report': report, 'figures': figures, 'created_at': now}
+    try:
+        client = get_redis()
+        client.set(key, json.dumps(entry), ex=REPORT_CACHE_TTL)
+        client.set(_latest_key(identity), key, ex=REPORT_CACHE_TTL)
+
+        client.zadd(REPORT_CACHE_INDEX, {key: now})
+        client.zremrangebyscore(REPORT_CACHE_INDEX, 0, now - REPORT_CACHE_TTL)
+        overflow = client.zcard(REPORT_CACHE_INDEX) - REPORT_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            evicted = [member for member, _ in client.zpopmin(REPORT_CACHE_INDEX, overflow)]
+            client.delete(*evicted)
+    except redis.exceptions.RedisError as e:
+        logging.warning(f"Unable to cache report for {identity}: {e}")
@@ -0,0 +1,87 @@
+import logging
+import os
+import threading
+from config import REDIS_HOST, REDIS_PORT, GOOGLE_CREDENTIALS_PATH, EMBEDDING_MODEL_NAME, CATALOGUE_STORE_PATH
+
+# Shared models and clients, created on first use (or by warm_up) rather than at import
+_resources = {}
+_lock = threading.Lock()
+
+def _get(name, factory):
+    resource = _resources.get(name)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(name)
+            if resource is None:
+                logging.info(f"Initializing {name}...")
+                resource = factory()
+                _resources[name] = resource
+    return resource
+
+def _create_model():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+def _create_vision_client():
+    from google.cloud import vision
+    from google.oauth2 import service_account
+    credentials = service_account.Credentials.from_service_account_file(GOOGLE_CREDENTIALS_PATH)
+    return vision.ImageAnnotatorClient(credentials=credentials)
+
+def _create_anthropic_client():
+    import anthropic
+    api_key = os.getenv('ANTHROPIC_API_KEY')
+    if not api_key:
+        raise ValueError("API Key is not set.")
+    return anthropic.Client(api_key=api_key)
+
+def _create_redis():
+    import redis
+    return redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+
+def _create_vector_index():
+    from utils.vector_index import get_index
+    return get_index()
+
+def _create_catalogue_store():
+    from utils.catalogue_store import CatalogueStore
+    from utils.generations import GenerationCache
+    return GenerationCache(CATALOGUE_STORE_PATH, CatalogueStore)
+
+def get_model():
+    return _get('model', _create_model)
+
+def get_vision_client():
+    return _get('vision_client', _create_vision_client)
+
+def get_anthropic_client():
+    return _get('anthropic_client', _create_anthropic_client)
+
+def get_redis():
+    return _get('redis', _create_redis)
+
+def get_vector_index():
+    return _get('vector_index', _create_vector_index)
+
+def get_catalogue_store():
+    """The catalogue store's current generation; take it once per lookup so every step sees the same rows."""
+    return _get('catalogue_store', _create_catalogue_store).current()
+
+_getters = {
+    'model': get_model,
+    'vision_client': get_vision_client,
+    'anthropic_client': get_anthropic_client,
+    'redis': get_redis,
+    'vector_index': get_vector_index,
+    'catalogue_store': get_catalogue_store,
+}
+
+def warm_up(names=None):
+    """
+    Create resources ahead of the first request.
+
+    Call with ['model'] in a pre-fork master so workers share the loaded model copy-on-write;
+    network clients are better created after the fork.
+    """
+    for name in names or _getters:
+        _getters[name]()
@@ -0,0 +1,159 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import redis
+from utils.resources import get_redis
+from config import (UPLOAD_FOLDER, UPLOAD_SPOOL_MAX_BYTES, UPLOAD_RETENTION_SECONDS, UPLOAD_MAX_BYTES, UPLOAD_GC_INTERVAL,
+                    JOB_TTL)
+
+# Only files named by their content hash are ours to garbage collect
+STORED_NAME_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+CHUNK_SIZE = 64 * 1024
+# Sorted set of "<job_id> <path>" by pin time: stored uploads that queued jobs still need
+PINNED_UPLOADS_KEY = 'uploads:pinned'
+
+class UploadTooLarge(Exception):
+    """An upload went past the byte limit it was received with."""
+
+_gc_lock = threading.Lock()
+_last_gc = 0.0
+
+class Upload:
+    """
+    An uploaded image held for the length of a request.
+
+    The bytes live in a SpooledTemporaryFile, in memory up to UPLOAD_SPOOL_MAX_BYTES and in an
+    anonymous temp file beyond that, so the pipeline never re-reads the upload from UPLOAD_FOLDER.
+    """
+
+    def __init__(self, filename, file, digest, size):
+        self.filename = filename
+        self.file = file
+        self.digest = digest
+        self.size = size
+
+    @property
+    def stored_name(self):
+        # The name is the content alone; Pillow detects the format from the bytes
+        return self.digest
+
+    def open(self):
+        """Return the underlying file, rewound so the next reader sees the whole image."""
+        self.file.seek(0)
+        return self.file
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def receive(stream, filename, max_bytes=None):
+    """
+    Spool a binary stream into an Upload, hashing it on the way in.
+
+    With `max_bytes`, reading stops and UploadTooLarge is raised as soon as the stream goes
+    past it, so an oversized (or decompressing) stream never fills memory or disk.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_BYTES)
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if max_bytes is not None and size > max_bytes:
+            spooled.close()
+            raise UploadTooLarge(f"{filename} is larger than {max_bytes} bytes")
+        digest.update(chunk)
+        spooled.write(chunk)
+    spooled.seek(0)
+    return Upload(filename, spooled, digest.hexdigest(), size)
+
+def persist(upload, folder=UPLOAD_FOLDER):
+    """
+    Keep a copy of the upload under its content hash and return the path.
+
+    Identical uploads share one file, so concurrent uploads of "1.jpg" cannot overwrite each
+    other; storing an image again only refreshes its age for garbage collection.
+    """
+    path = os.path.join(folder, upload.stored_name)
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        # A unique temp file per writer, since other threads and worker processes may be storing the same image
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=f"{upload.stored_name}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(upload.open(), f, CHUNK_SIZE)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    maybe_collect_garbage(folder)
+    return path
+
+def pin(job_id, path):
+    """Keep a stored upload from garbage collection until the job is unpinned (or JOB_TTL passes)."""
+    get_redis().zadd(PINNED_UPLOADS_KEY, {f"{job_id} {path}": time.time()})
+
+def unpin(job_id, path):
+    get_redis().zrem(PINNED_UPLOADS_KEY, f"{job_id} {path}")
+
+def pinned_paths(now=None):
+    """Paths of stored uploads pinned by jobs that have not finished or expired."""
+    now = now or time.time()
+    client = get_redis()
+    client.zremrangebyscore(PINNED_UPLOADS_KEY, 0, now - JOB_TTL)
+    return {member.decode('utf-8').split(' ', 1)[1] for member in client.zrange(PINNED_UPLOADS_KEY, 0, -1)}
+
+def collect_garbage(folder=UPLOAD_FOLDER, now=None):
+    """
+    Delete stored uploads older than UPLOAD_RETENTION_SECONDS, then the oldest ones until the
+    folder's stored uploads fit in UPLOAD_MAX_BYTES. Uploads that queued jobs still point at
+    are never removed. Returns the number of files removed.
+    """
+    now = now or time.time()
+    pinned = {os.path.abspath(path) for path in pinned_paths(now)}
+    stored = []
+    for entry in os.scandir(folder):
+        if entry.is_file() and STORED_NAME_PATTERN.match(entry.name) and os.path.abspath(entry.path) not in pinned:
+            stat = entry.stat()
+            stored.append((stat.st_mtime, stat.st_size, entry.path))
+    stored.sort()
+
+    total = sum(size for _, size, _ in stored)
+    removed = 0
+    for mtime, size, path in stored:
+        if mtime >= now - UPLOAD_RETENTION_SECONDS and total <= UPLOAD_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+            total -= size
+        except OSError as e:
+            logging.warning(f"Unable to remove stored upload {path}: {e}")
+    if removed:
+        logging.info(f"Removed {removed} stored uploads from {folder}")
+    return removed
+
+def maybe_collect_garbage(folder=UPLOAD_FOLDER):
+    """Run collect_garbage at most once every UPLOAD_GC_INTERVAL seconds per process."""
+    global _last_gc
+    with _gc_lock:
+        if time.time() - _last_gc < UPLOAD_GC_INTERVAL:
+            return
+        _last_gc = time.time()
+    try:
+        collect_garbage(folder)
+    except (OSError, redis.exceptions.RedisError) as e:
+        logging.warning(f"Upload garbage collection failed in {folder}: {e}")
@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import time
+import numpy as np
+import redis
+from config import VECTOR_INDEX_BACKEND, LOCAL_INDEX_PATH, PINECONE_NAMESPACE, NAMESPACE_REFRESH_SECONDS
+from utils.resources import get_redis
+from utils.generations import GenerationCache, new_generation, publish_generation
+
+ACTIVE_NAMESPACE_KEY = 'vector_index:active_namespace'
+
+def _load_generation(generation):
+    """Return (vectors, entries) for a generation directory, memory-mapping the vectors."""
+    if generation is None:
+        return np.zeros((0, 0), dtype=np.float32), []
+    vectors = np.load(os.path.join(generation, 'vectors.npy'), mmap_mode='r')
+    with open(os.path.join(generation, 'entries.json'), 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    logging.info(f"Loaded local vector index with {len(entries)} vectors from {generation}")
+    return vectors, entries
+
+class LocalIndex:
+    """
+    In-process vector index with the subset of the Pinecone Index API we use.
+
+    Embeddings are stored L2-normalized in a .npy matrix that is memory-mapped on load, so
+    cosine similarity is a single matrix-vector product with exact top-k. Each save writes a
+    new generation (see utils.generations), which serving processes pick up on their next
+    check of CURRENT.
+    """
+
+    def __init__(self, path=LOCAL_INDEX_PATH):
+        self.path = path
+        self._generations = GenerationCache(path, _load_generation)
+        self._pending = None
+
+    def query(self, vector, top_k=10, include_metadata=True):
+        vectors, entries = self._generations.current()
+        if not entries:
+            return {'matches': []}
+        # A copy, so the caller's array is left as it was
+        query_vector = np.array(vector, dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+        scores = vectors @ query_vector
+
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        matches = []
+        for row in top:
+            entry = entries[row]
+            match = {'id': entry['id'], 'score': float(scores[row])}
+            if include_metadata:
+                match['metadata'] = entry['metadata']
+            matches.append(match)
+        return {'matches': matches}
+
+    def _start_write(self):
+        if self._pending is None:
+            vectors, entries = self._generations.current()
+            self._pending = {
+                entry['id']: (np.asarray(vectors[row], dtype=np.float32), entry['metadata'])
+                for row, entry in enumerate(entries)
+            }
+
+    def upsert(self, vectors):
+        self._start_write()
+        for item in vectors:
+            values = np.array(item['values'], dtype=np.float32)
+            values /= np.linalg.norm(values) or 1.0
+            self._pending[item['id']] = (values, item.get('metadata', {}))
+        return {'upserted_count': len(vectors)}
+
+    def delete(self, ids=None, delete_all=False):
+        self._start_write()
+        if delete_all:
+            self._pending.clear()
+        for vector_id in ids or []:
+            self._pending.pop(vector_id, None)
+        return {}
+
+    def save(self):
+        """Write pending changes as a new generation and make it current."""
+        if self._pending is None:
+            return
+        generation = new_generation(self.path)
+
+        ids = list(self._pending)
+        if ids:
+            matrix = np.stack([self._pending[vector_id][0] for vector_id in ids])
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        np.save(os.path.join(generation, 'vectors.npy'), matrix)
+        with open(os.path.join(generation, 'entries.json'), 'w', encoding='utf-8') as f:
+            json.dump([{'id': vector_id, 'metadata': self._pending[vector_id][1]} for vector_id in ids], f)
+
+        publish_generation(self.path, generation)
+        self._pending = None
+        self._generations.invalidate()
+
+    def describe_index_stats(self):
+        if self._pending is not None:
+            return {'total_vector_count': len(self._pending)}
+        return {'total_vector_count': len(self._generations.current()[1])}
+
+class PineconeIndex:
+    """
+    Pinecone index bound to a namespace.
+
+    Unless a namespace is given explicitly, the active namespace is read from Redis (set by
+    activate_namespace) and re-checked every NAMESPACE_REFRESH_SECONDS, so a freshly built
+    shadow namespace can be swapped in without restarting workers.
+    """
+
+    def __init__(self, namespace=None):
+        from pinecone import Pinecone
+        pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
+        self.index = pc.Index(os.getenv('PINECONE_INDEX_NAME'))
+        self.namespace = namespace
+        self._active = None
+        self._checked_at = 0.0
+
+    def _namespace(self):
+        if self.namespace is not None:
+            return self.namespace
+        if self._active is None or time.time() - self._checked_at > NAMESPACE_REFRESH_SECONDS:
+            self._active = get_active_namespace()
+            self._checked_at = time.time()
+        return self._active
+
+    def query(self, vector, top_k=10, include_metadata=True):
+        return self.index.query(vector=vector, top_k=top_k, include_metadata=include_metadata, namespace=self._namespace())
+
+    def upsert(self, vectors):
+        return self.index.upsert(vectors=vectors, namespace=self._namespace())
+
+    def delete(self, ids=None, delete_all=False):
+        if delete_all:
+            return self.index.delete(delete_all=True, namespace=self._namespace())
+        return self.index.delete(ids=ids, namespace=self._namespace())
+
+    def describe_index_stats(self):
+        namespaces = self.index.describe_index_stats()['namespaces']
+        namespace = namespaces.get(self._namespace())
+        return {'total_vector_count': namespace['vector_count'] if namespace else 0}
+
+def get_active_namespace():
+    """Return the Pinecone namespace queries should use."""
+    try:
+        active = get_redis().get(ACTIVE_NAMESPACE_KEY)
+    except redis.exceptions.RedisError as e:
+        logging.warning(f"Unable to read active vector namespace from Redis: {e}")
+        active = None
+    return active.decode('utf-8') if active else PINECONE_NAMESPACE
+
+def activate_namespace(namespace):
+    """Atomically point every worker at a new namespace. Returns the previous one."""
+    previous = get_redis().getset(ACTIVE_NAMESPACE_KEY, namespace)
+    return previous.decode('utf-8') if previous else PINECONE_NAMESPACE
+
+def get_index(backend=VECTOR_INDEX_BACKEND, namespace=None):
+    """Return the vector index selected by VECTOR_INDEX_BACKEND ('pinecone' or 'local')."""
+    if backend == 'local':
+        return LocalIndex()
+    if backend == 'pinecone':
+        return PineconeIndex(namespace=namespace)
+    raise ValueError(f"Unknown VECTOR_INDEX_BACKEND: {backend}")
@@ -0,0 +1,13 @@
+import logging
+from utils.jobs import run_worker
+from utils.resources import warm_up
+
+# Setup logging
+logging.basicConfig(level=logging.INFO, 
+                    format='%(asctime)s [%(levelname)s] %(message)s', 
+                    handlers=[logging.FileHandler("worker.log"), 
+                              logging.StreamHandler()])
+
+if __name__ == '__main__':
+    warm_up(['model'])
+    run_worker()